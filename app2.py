@@ -1,16 +1,34 @@
-from flask import Flask, request, jsonify, render_template,session
-import xml.etree.ElementTree as ET
+import time
+STARTED_AT = time.perf_counter()
+
+from flask import Flask, request, jsonify, render_template,session, Response, stream_with_context, g
+from flask.sessions import SecureCookieSessionInterface
 from flask_cors import CORS
 import os 
 from dotenv import load_dotenv
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor
-from langsmith import traceable
-from langsmith.wrappers import wrap_openai
 import zipfile
-from google.cloud import secretmanager
 import json
-import re
+import functools
+import threading
+from twb_extract import STREAM_THRESHOLD_BYTES, read_twb_metadata
+from metadata_cache import MetadataCache, content_hash, is_cache_key
+from conversion_cache import ConversionCache, conversion_key
+from formula_templates import restore, templatize
+from formula_transpiler import UnsupportedFormula, transpile
+from twbx_archive import UnsafeArchive, check_member, find_root_twb, spool_upload
+from conversion_engine import ConversionEngine, DeadlineExceeded, estimate_tokens, is_retryable
+from conversion_batches import BATCH_SYSTEM_PROMPT, COMPLETION_TOKENS_PER_FORMULA, batch_prompt, make_batches, parse_batch_response
+from batch_extract import read_workbook
+from jobs import DONE, JobRunner, JobStore
+from metrics import REGISTRY, CallbackMetric, Counter, Histogram, StageTimer
+from secret_store import CachedSecrets, provider_from_env
+from session_store import SessionStore
+from workbook_diff import changed_calculations, diff_metadata
+from xml_backend import PARSE_ERRORS
+import tempfile
+import tracemalloc
+import uuid
+from concurrent.futures import FIRST_COMPLETED, wait
 
 load_dotenv()
 
@@ -19,31 +37,257 @@ app.secret_key = os.getenv("APP_SECRET_KEY")
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "teqcertify-50657adb7cfc.json"
 
-def fetch_api_key():
-    client = secretmanager.SecretManagerServiceClient()
-    secret_name = "projects/457073865923/secrets/Tableau_Accelerator/versions/3"
-    response = client.access_secret_version(request={"name": secret_name})
-    api_key = response.payload.data.decode("UTF-8")
-    return api_key
-
-api_key = fetch_api_key()
-apikey_dict = json.loads(api_key)
-open_api_key = apikey_dict['OPEN_AI_API_KEY']
-app_secret_key = apikey_dict['APP_SECRET_KEY']
-langchain_api_key = apikey_dict.get('LANGCHAIN_API_KEY')
-
-
-
-app.secret_key = app_secret_key
+# Secrets, the OpenAI client and the LangSmith SDK are all set up on first
+# use so that a cold start serves requests without waiting on Secret Manager.
+# For offline runs set SECRETS_FILE (a JSON file shaped like the Secret
+# Manager payload) or OPEN_AI_API_KEY/APP_SECRET_KEY in the environment.
+secrets = CachedSecrets(
+    provider_from_env("projects/457073865923/secrets/Tableau_Accelerator/versions/3"),
+    ttl_seconds=int(os.getenv('SECRETS_TTL_SECONDS', 3600))
+)
+if os.getenv('SECRETS_PREFETCH', 'true').lower() in ('1', 'true', 'yes'):
+    secrets.prefetch()
+
+class LazySecretSessionInterface(SecureCookieSessionInterface):
+    # Only requests that carry or set a session cookie need the signing key.
+    def open_session(self, app, request):
+        if not request.cookies.get(self.get_cookie_name(app)):
+            return self.session_class()
+        load_app_secret_key()
+        return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        if session:
+            load_app_secret_key()
+        super().save_session(app, session, response)
+
+def load_app_secret_key():
+    app.secret_key = secrets.get('APP_SECRET_KEY') or os.getenv("APP_SECRET_KEY")
+
+app.session_interface = LazySecretSessionInterface()
 CORS(app)
 
 os.environ['LANGCHAIN_TRACING_V2']='true'
 LANGCHAIN_ENDPOINT="https://api.smith.langchain.com/api/v1/runs/multipart"
-LANGCHAIN_API_KEY=langchain_api_key
 os.environ['LANGCHAIN_PROJECT']="Tableau-Accelerator"
 
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+def get_openai_client():
+    # Rebuilt whenever a secrets refresh returns a rotated key. Retries are
+    # handled by the conversion engine, not the SDK. OPENAI_BASE_URL points
+    # the client at any OpenAI-compatible server, e.g. a local mock.
+    global _client, _client_key
+    api_key = secrets.get('OPEN_AI_API_KEY')
+    with _client_lock:
+        if _client is None or _client_key != api_key:
+            from openai import OpenAI
+            from langsmith.wrappers import wrap_openai
+
+            langchain_api_key = secrets.get('LANGCHAIN_API_KEY')
+            if langchain_api_key:
+                os.environ.setdefault('LANGCHAIN_API_KEY', langchain_api_key)
+            _client = wrap_openai(OpenAI(api_key=api_key, base_url=os.getenv('OPENAI_BASE_URL'), max_retries=0))
+            _client_key = api_key
+        return _client
+
+def traceable(fn):
+    # langsmith.traceable, applied on the first call instead of at import.
+    traced = []
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not traced:
+            from langsmith import traceable as langsmith_traceable
+            traced.append(langsmith_traceable(fn))
+        return traced[0](*args, **kwargs)
+    return wrapper
+
+OPENAI_MODEL = "gpt-4o"
+# Part of the conversion cache key; bump whenever the single or batched
+# conversion prompt changes.
+PROMPT_VERSION = '1'
+
+conversion_cache = ConversionCache(
+    os.getenv('CONVERSION_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'tableau_accelerator_conversions.db')),
+    ttl_seconds=int(os.getenv('CONVERSION_CACHE_TTL', 30 * 24 * 3600)),
+    max_entries=int(os.getenv('CONVERSION_CACHE_SIZE', 100000))
+)
+
+conversion_engine = ConversionEngine(
+    max_workers=int(os.getenv('CONVERSION_MAX_WORKERS', 8)),
+    requests_per_minute=int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 500)),
+    tokens_per_minute=int(os.getenv('OPENAI_TOKENS_PER_MINUTE', 30000)),
+    max_retries=int(os.getenv('OPENAI_MAX_RETRIES', 5))
+)
+CONVERSION_DEADLINE_SECONDS = float(os.getenv('CONVERSION_DEADLINE_SECONDS', 240))
+
+# Formulas per batched prompt and the estimated token budget of one batch.
+# A batch size of 1 disables batching and uses one request per formula.
+CONVERSION_BATCH_SIZE = int(os.getenv('CONVERSION_BATCH_SIZE', 20))
+CONVERSION_BATCH_TOKENS = int(os.getenv('CONVERSION_BATCH_TOKENS', 4000))
+
+# Convert formulas in the supported subset of the language locally and send
+# only the rest (LOD expressions, table calculations, ...) to the model.
+RULE_BASED_CONVERSION = os.getenv('RULE_BASED_CONVERSION', 'true').lower() in ('1', 'true', 'yes')
+
+CONVERSION_ERROR = 'Error converting formula'
+CONVERSION_TIMEOUT = 'Conversion timed out'
+
+# Extraction results keyed by a hash of the workbook XML. The in-memory tier
+# is bounded by both METADATA_CACHE_SIZE and METADATA_CACHE_MEMORY_BYTES; the
+# on-disk tier is only enabled when METADATA_CACHE_DIR is set.
+metadata_cache = MetadataCache(
+    max_entries=int(os.getenv('METADATA_CACHE_SIZE', 128)),
+    memory_max_bytes=int(os.getenv('METADATA_CACHE_MEMORY_BYTES', 64 * 1024 * 1024)),
+    disk_dir=os.getenv('METADATA_CACHE_DIR'),
+    disk_max_bytes=int(os.getenv('METADATA_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+)
+
+# Calculations of each extracted workbook, kept server-side under a token
+# that is returned with the metadata and remembered in the session cookie.
+# Set SESSION_STORE_PATH to also keep them in SQLite across restarts.
+calculation_store = SessionStore(
+    max_entries=int(os.getenv('SESSION_STORE_SIZE', 256)),
+    ttl_seconds=int(os.getenv('SESSION_STORE_TTL', 6 * 3600)),
+    path=os.getenv('SESSION_STORE_PATH')
+)
+
+# Background jobs for workbooks too large to handle inside one request.
+# Uploads are kept in JOB_UPLOAD_DIR until their job finishes. New jobs are
+# refused with 503 while JOB_MAX_QUEUED jobs are already waiting.
+job_store = JobStore(
+    os.getenv('JOB_DB_PATH', os.path.join(tempfile.gettempdir(), 'tableau_accelerator_jobs.db')),
+    lease_seconds=int(os.getenv('JOB_LEASE_SECONDS', 300)),
+    max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 3)),
+    retention_seconds=int(os.getenv('JOB_RETENTION_SECONDS', 24 * 3600))
+)
+JOB_UPLOAD_DIR = os.getenv('JOB_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'tableau_accelerator_uploads'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_MAX_QUEUED = int(os.getenv('JOB_MAX_QUEUED', 100))
+JOB_DEADLINE_SECONDS = float(os.getenv('JOB_DEADLINE_SECONDS', 3600))
+
+# Metrics served by /metrics. SERVER_TIMING=true also reports each
+# request's stage timings in a Server-Timing response header.
+# METRICS_TRACE_MEMORY=true records the peak Python memory of every
+# request with tracemalloc; it slows requests down noticeably, and requests
+# that overlap share one peak.
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+METRICS_TRACE_MEMORY = os.getenv('METRICS_TRACE_MEMORY', 'false').lower() in ('1', 'true', 'yes')
+if METRICS_TRACE_MEMORY:
+    tracemalloc.start()
+
+BYTE_BUCKETS = tuple(64 * 1024 * 4 ** power for power in range(9))
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'tableau_accelerator_http_request_seconds', 'Time to handle each request.', ('endpoint', 'method', 'status')
+)
+EXTRACTION_STAGE_SECONDS = Histogram(
+    'tableau_accelerator_extraction_stage_seconds',
+    'Time spent in each stage of metadata extraction. Streaming extractions report parsing and metadata records '
+    'together as the stream stage.',
+    ('stage',)
+)
+UPLOAD_BYTES = Histogram(
+    'tableau_accelerator_upload_bytes',
+    'Size of uploaded workbooks; twbx_workbook is the uncompressed workbook inside a .twbx.',
+    ('kind',), buckets=BYTE_BUCKETS
+)
+REQUEST_PEAK_MEMORY_BYTES = Histogram(
+    'tableau_accelerator_request_peak_memory_bytes',
+    'Peak Python memory allocated while handling a request (only with METRICS_TRACE_MEMORY=true).',
+    ('endpoint',), buckets=BYTE_BUCKETS
+)
+OPENAI_TOKENS = Counter(
+    'tableau_accelerator_openai_tokens_total', 'Tokens reported by the OpenAI API.', ('kind', 'mode')
+)
+FORMULAS_CONVERTED = Counter(
+    'tableau_accelerator_formulas_converted_total',
+    'Formulas converted, by what converted them and whether it succeeded.',
+    ('converted_by', 'result')
+)
+
+def cache_counts(field):
+    # Read from the caches' own stats at scrape time. Disk hits of the
+    # metadata cache count as hits.
+    def counts():
+        metadata = metadata_cache.stats()
+        return [
+            (('metadata',), metadata[field] + (metadata['disk_hits'] if field == 'hits' else 0)),
+            (('conversions',), conversion_cache.stats()[field]),
+            (('sessions',), calculation_store.stats()[field]),
+        ]
+    return counts
+
+CallbackMetric('tableau_accelerator_cache_hits_total', 'Cache lookups that found an entry.', 'counter',
+               cache_counts('hits'), ('cache',))
+CallbackMetric('tableau_accelerator_cache_misses_total', 'Cache lookups that found nothing.', 'counter',
+               cache_counts('misses'), ('cache',))
+CallbackMetric('tableau_accelerator_jobs_queued', 'Background jobs waiting for a worker.', 'gauge',
+               lambda: [((), job_store.queued())])
+
+try:
+    import resource
+except ImportError:
+    resource = None
+else:
+    # ru_maxrss is in kilobytes on Linux.
+    CallbackMetric('tableau_accelerator_process_max_rss_bytes', 'Peak resident memory of this process.', 'gauge',
+                   lambda: [((), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)])
+
+@app.before_request
+def start_request_timer():
+    g.timer = StageTimer()
+    if METRICS_TRACE_MEMORY:
+        tracemalloc.reset_peak()
+        g.memory_at_start = tracemalloc.get_traced_memory()[0]
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    labels = {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)}
+    started = g.timer.started
+    memory_at_start = g.get('memory_at_start', 0)
+
+    def observe():
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, **labels)
+        if METRICS_TRACE_MEMORY:
+            REQUEST_PEAK_MEMORY_BYTES.observe(tracemalloc.get_traced_memory()[1] - memory_at_start, endpoint=endpoint)
+
+    # A streamed body is produced after this runs, so its request is
+    # observed once the server closes the response.
+    if response.is_streamed:
+        response.call_on_close(observe)
+    else:
+        observe()
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = g.timer.server_timing()
+    return response
+
+def record_extraction(timer):
+    for stage, seconds in timer.seconds.items():
+        EXTRACTION_STAGE_SECONDS.observe(seconds, stage=stage)
+
+def record_usage(response, mode):
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        OPENAI_TOKENS.inc(usage.prompt_tokens, kind='prompt', mode=mode)
+        OPENAI_TOKENS.inc(usage.completion_tokens, kind='completion', mode=mode)
+
+def record_conversion(result):
+    if result['domo_formula'] == CONVERSION_TIMEOUT:
+        outcome = 'timeout'
+    elif result['domo_formula'] == CONVERSION_ERROR:
+        outcome = 'error'
+    else:
+        outcome = 'ok'
+    FORMULAS_CONVERTED.inc(converted_by=result['converted_by'], result=outcome)
 
-client =wrap_openai(OpenAI(api_key= api_key))
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/')
 def upload_file():
@@ -59,26 +303,41 @@ def extract_metadata():
         return jsonify({'error': 'No selected file'}), 400
 
     if file.filename.endswith('.twb'):
+        UPLOAD_BYTES.observe(request.content_length or 0, kind='twb')
         try:
-            return process_twb_file(file)
-        except ET.ParseError:
+            with g.timer.stage('hash'):
+                cache_key = content_hash(file.stream)
+            file.stream.seek(0)
+            return process_twb_file(file, stream=use_streaming(request.content_length), cache_key=cache_key)
+        except PARSE_ERRORS:
             return jsonify({'error': 'Error parsing the XML'}), 400
         except Exception as e:
             print(f"An error occurred: {e}")
             return jsonify({'error': 'An internal error occurred.'}), 500
         
     elif file.filename.endswith('.twbx'):
+        UPLOAD_BYTES.observe(request.content_length or 0, kind='twbx')
         try:
-            with zipfile.ZipFile(file) as z:
-                for name in z.namelist():
-                    if name.endswith('.twb'):
-                        with z.open(name) as twb_file:
-                            return process_twb_file(twb_file)
-
-                return jsonify({'error': 'No .twb file found inside the .twbx archive'}), 400
+            with spool_upload(file.stream) as archive, zipfile.ZipFile(archive) as z:
+                info = find_root_twb(z)
+                if info is None:
+                    return jsonify({'error': 'No .twb file found inside the .twbx archive'}), 400
+                check_member(info)
+                UPLOAD_BYTES.observe(info.file_size, kind='twbx_workbook')
+
+                # Only the workbook XML is hashed, so re-packaging the same
+                # workbook with a refreshed extract still hits the cache.
+                with z.open(info) as twb_file, g.timer.stage('hash'):
+                    cache_key = content_hash(twb_file)
+                with z.open(info) as twb_file:
+                    return process_twb_file(twb_file, stream=use_streaming(info.file_size), cache_key=cache_key)
 
         except zipfile.BadZipFile:
             return jsonify({'error': 'Invalid .twbx file'}), 400
+        except UnsafeArchive as e:
+            return jsonify({'error': f'Rejected .twbx file: {e}'}), 400
+        except PARSE_ERRORS:
+            return jsonify({'error': 'Error parsing the XML'}), 400
         except Exception as e:
             print(f"An error occurred: {e}")
             return jsonify({'error': 'An internal error occurred.'}), 500
@@ -87,242 +346,452 @@ def extract_metadata():
         return jsonify({'error': 'Invalid file type. Only .twb and .twbx files are allowed.'}), 400
 
 
-def process_twb_file(file):
-    tree = ET.parse(file)
-    root = tree.getroot()
-
-    metadata = {
-        'title': root.get('original-version', 'No title found'),
-        'datasources': [],
-        'dashboards': [],
-        "worksheets":[],
-        'calculations': [],
-        'parameters': [],
-        'joins': [],
-        'columns': [],
-        'Table':{}
-    }
-
-    calculation_mapping = {}
-
-    datasources = root.find('datasources')
-    if datasources is not None:
-        for datasource in datasources.findall('datasource'):
-
-            connections = datasource.findall('connection')
-
-            for connection in connections:
-                named_connections = connection.findall('.//named-connections/named-connection')
-                for nc in named_connections:
-                    inner_conn = nc.find('connection')
-                    conn_type = conn_name = server_name = db_name = 'N/A'
-                    table_columns = []
-
-                    if inner_conn is not None:
-                        conn_type = inner_conn.get('class', 'N/A')
-                        conn_name = inner_conn.get('server', 'N/A')
-                        server_name = inner_conn.get('server', 'N/A')
-                        db_name = inner_conn.get('dbname', 'N/A')
-
-                    relation = datasource.findall('connection/relation/relation')
-                    if relation is not None:
-                        table_columns = [col.get('name', 'Unnamed Column') for col in relation]
-
-                    datasource_details = {
-                        'Connection Type': conn_type,
-                        'Connection Name': conn_name,
-                        'Server Name': server_name,
-                        'Database Name': db_name,
-                        'Tables': table_columns
-                    }
-
-                    metadata['datasources'].append(datasource_details)
-            table_metadata = {}
-            metadata_records = datasource.findall('.//metadata-records/metadata-record')
-            for record in metadata_records:
-                if record is not None:
-                    raw_table_name = record.findtext('parent-name', default='[Unknown Table]')
-                    table_name = re.sub(r'[\[\]]', '', raw_table_name).strip()
-                    column_name = record.findtext('remote-name', default='Unknown Column')
-                    col_type = record.findtext('local-type', default='Unknown Type')
-
-                    if table_name not in table_metadata:
-                        table_metadata[table_name] = []
-
-                    table_metadata[table_name].append({"column_name" : column_name, "col_type" : col_type})
-            metadata['Table'] = table_metadata
-
-    for datasource in datasources.findall('datasource'):
-        for column in datasource.findall('column'):
-            column_info = {
-                'name': column.get('name', 'Unnamed Column'),
-                'datatype': column.get('datatype', 'Unknown Datatype'),
-                'role': column.get('role', 'Unknown Role'),
-                'aggregation': column.get('aggregation', 'None'),
-            }
-            metadata['columns'].append(column_info)
-
-    worksheets = root.findall(".//worksheet")
-    for worksheet in worksheets:
-        type_tree = worksheet.find(".//table/panes/pane/mark")
-        worksheet_info = {
-            'name': worksheet.get('name', 'Unnamed Worksheet'),
-            'type':type_tree.get('class','Unknown Type')
-        }
-        metadata['worksheets'].append(worksheet_info)
-
-    dashboards = root.find('dashboards')
-    if dashboards is not None:
-        for dashboard in dashboards.findall('dashboard'):
-            dashboard_name = dashboard.get('name', 'Unnamed Dashboard')
-            worksheet_names = []
-
-            zones = dashboard.findall('.//zones/zone')
-            for zone in zones:
-                run_element = zone.find('.//formatted-text/run')
-                if run_element is not None and run_element.text:
-                    worksheet_names.append(run_element.text)
-
-            seen = set()
-            unique_worksheets = []
-            for ws in worksheet_names:
-                if ws not in seen:
-                    seen.add(ws)
-                    unique_worksheets.append(ws)
-
-            metadata['dashboards'].append({
-                'Dashboard Name': dashboard_name,
-                'Worksheets': unique_worksheets
-            })
-
-
-    for datasource in datasources.findall(".//datasource"):
-        calculated_fields = datasource.findall(".//column[calculation]")  
-        for calc_field in calculated_fields:
-            calc_element = calc_field.find('calculation')  
-            if calc_element is not None:
-                formula = calc_element.get('formula', 'No formula')
-                calc_name = calc_field.get('caption', calc_field.get('name', 'Unnamed Calculation'))
-                name = calc_field.get('name')
-
-                calc_info = {
-                    'name': calc_name,
-                    'formula': formula
-                }
-                if is_parameter(formula):
-                    metadata['parameters'].append(calc_info)
-                else:
-                    metadata['calculations'].append(calc_info)
-                    calculation_mapping[name] = formula
-
-    for calc in metadata['calculations']:
-        formula = calc['formula']
-        for name, calc_formula in calculation_mapping.items():
-            pattern = r'(?i)\bcalculation.*?_\d+\b'
-            formula = re.sub(pattern, calc_formula, formula)
-        calc['formula'] = formula
-
-
-    session['calculations'] = metadata['calculations']
-
-    metadata['joins'] = extract_joins(datasources)
-    metadata['relationships'] = extract_relationships(datasources)
-
-    return jsonify(metadata)
-
-def is_parameter(formula):
-    if formula.isdigit() or formula.startswith('"') or formula.startswith('#'):
+def process_twb_file(file, stream=False, cache_key=None):
+    # The cache key doubles as the extraction id. Passing an earlier one as
+    # '?previous=<extraction_id>' adds a diff against that extraction, and
+    # only added or changed calculations are queued for conversion.
+    previous = None
+    previous_id = request.args.get('previous')
+    if previous_id:
+        if not is_cache_key(previous_id):
+            return jsonify({'error': 'Invalid previous extraction id'}), 400
+        previous = metadata_cache.get(previous_id)
+        if previous is None:
+            return jsonify({'error': 'Unknown or expired previous extraction id'}), 404
+
+    metadata = None
+    if cache_key is not None:
+        metadata = metadata_cache.get(cache_key)
+    cache_status = 'HIT' if metadata is not None else 'MISS'
+
+    if metadata is None:
+        timer = StageTimer()
+        metadata = read_twb_metadata(file, stream=stream, timer=timer)
+        record_extraction(timer)
+        for stage, seconds in timer.seconds.items():
+            g.timer.add(stage, seconds)
+        if cache_key is not None:
+            metadata_cache.put(cache_key, metadata)
+
+    token = calculation_store.put(metadata['calculations'])
+    payload = dict(metadata, extraction_id=cache_key, calculations_token=token)
+    if previous is not None:
+        payload['diff'] = diff_metadata(previous, metadata)
+        changed = changed_calculations(metadata, payload['diff'])
+        token = payload['changed_calculations_token'] = calculation_store.put(changed)
+    session['calculations_token'] = token
+
+    response = jsonify(payload)
+    response.headers['X-Cache'] = cache_status
+    return response
+
+def use_streaming(size):
+    # '?mode=stream' forces incremental parsing for any size.
+    if request.args.get('mode') == 'stream':
         return True
-    return False
-    
+    return size is not None and size >= STREAM_THRESHOLD_BYTES
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    stats = metadata_cache.stats()
+    stats['conversions'] = conversion_cache.stats()
+    stats['sessions'] = calculation_store.stats()
+    return jsonify(stats)
+
 @app.route('/convert_to_domo', methods=['POST'])
 @traceable
 def convert_to_domo():
     try:
-        calculations = request.json.get('calculations', [])
+        calculations = load_calculations(request.json)
+        if calculations is None:
+            return jsonify({'error': 'Unknown or expired calculations token'}), 404
         if not calculations:
             return jsonify({'error': 'No calculations provided'}), 400
 
-        with ThreadPoolExecutor() as executor:
-            domo_formulas = list(executor.map(call_openai, [calc['formula'] for calc in calculations]))
+        deadline_seconds = float(request.json.get('deadline_seconds', CONVERSION_DEADLINE_SECONDS))
+        deadline = time.monotonic() + deadline_seconds
 
-        return jsonify(domo_formulas)
+        with g.timer.stage('convert'):
+            domo_formulas = convert_formulas([calc['formula'] for calc in calculations], deadline,
+                                             [calc.get('field_types') for calc in calculations])
+
+        response = jsonify(domo_formulas)
+        if any(result['domo_formula'] == CONVERSION_TIMEOUT for result in domo_formulas):
+            response.headers['X-Partial-Result'] = 'true'
+        return response
 
     except Exception as e:
         print(f"An error occurred: {e}")
         return jsonify({'error': 'An internal error occurred.'}), 500
 
-def call_openai(formula):
+@app.route('/convert_to_domo/stream', methods=['POST'])
+def convert_to_domo_stream():
+    calculations = load_calculations(request.json or {})
+    if calculations is None:
+        return jsonify({'error': 'Unknown or expired calculations token'}), 404
+    if not calculations:
+        return jsonify({'error': 'No calculations provided'}), 400
+
+    deadline_seconds = float(request.json.get('deadline_seconds', CONVERSION_DEADLINE_SECONDS))
+    deadline = time.monotonic() + deadline_seconds
+    formulas = [calc['formula'] for calc in calculations]
+    field_types = [calc.get('field_types') for calc in calculations]
+    use_sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+
+    def encode(record, event):
+        if use_sse:
+            return f"event: {event}\ndata: {json.dumps(record)}\n\n"
+        return json.dumps(record) + '\n'
+
+    def generate():
+        started = time.monotonic()
+        summary = {'total': len(formulas), 'converted': 0, 'errors': 0, 'timed_out': 0, 'by_rules': 0}
+        for index, result in iter_converted_formulas(formulas, deadline, field_types):
+            if result['converted_by'] == 'rules':
+                summary['by_rules'] += 1
+            if result['domo_formula'] == CONVERSION_TIMEOUT:
+                summary['timed_out'] += 1
+            elif result['domo_formula'] == CONVERSION_ERROR:
+                summary['errors'] += 1
+            else:
+                summary['converted'] += 1
+            yield encode(dict(result, index=index), 'result')
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        yield encode({'summary': summary}, 'summary')
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if use_sse else 'application/x-ndjson'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def load_calculations(body):
+    # Calculations are posted inline or referenced by the token returned
+    # from /extract_metadata, taken from the body or else the session.
+    # Returns None when a token was given but is unknown or has expired.
+    calculations = body.get('calculations')
+    if calculations:
+        return calculations
+    token = body.get('calculations_token') or session.get('calculations_token')
+    if not token:
+        return []
+    return calculation_store.get(token)
+
+def convert_formulas(formulas, deadline=None, field_types=None):
+    domo_formulas = [None] * len(formulas)
+    for index, result in iter_converted_formulas(formulas, deadline, field_types):
+        domo_formulas[index] = result
+    return domo_formulas
+
+def iter_converted_formulas(formulas, deadline=None, field_types=None):
+    # Yields (index, result) for every input formula as soon as its
+    # conversion finishes. Each result records in 'converted_by' whether
+    # the local transpiler or the model produced it. Formulas still
+    # pending at the deadline are yielded last as timed out. field_types
+    # gives, per formula, the datatypes of the fields it refers to, as
+    # extracted into each calculation's 'field_types'.
+    results = _iter_converted_formulas(formulas, deadline, field_types or [None] * len(formulas))
+    try:
+        for index, result in results:
+            record_conversion(result)
+            yield index, result
+    finally:
+        results.close()
+
+def _iter_converted_formulas(formulas, deadline, field_types):
+    llm_indexes = []
+    for index, formula in enumerate(formulas):
+        if RULE_BASED_CONVERSION:
+            try:
+                domo_formula = transpile(formula)
+            except UnsupportedFormula:
+                pass
+            else:
+                yield index, {'original_formula': formula, 'domo_formula': domo_formula, 'converted_by': 'rules'}
+                continue
+        llm_indexes.append(index)
+
+    templates = {index: templatize(formulas[index], field_types[index]) for index in llm_indexes}
+
+    # Formulas with the same shape and field types are converted once, with
+    # placeholders standing in for their field references.
+    indexes_by_template = {}
+    for index, (template, _) in templates.items():
+        indexes_by_template.setdefault(template, []).append(index)
+
+    remaining = set(llm_indexes)
+    pending = {}
+
+    def finish(template, domo_formula):
+        # Yields the result for every formula sharing the template. One
+        # whose placeholders cannot be put back is converted on its own.
+        for index in indexes_by_template[template]:
+            result = domo_formula
+            if result != CONVERSION_ERROR:
+                result = restore(domo_formula, templates[index][1]) or cached_conversion(formulas[index])
+                if result is None:
+                    pending[conversion_engine.submit(call_openai, formulas[index], deadline)] = ('fallback', index)
+                    continue
+            remaining.discard(index)
+            yield index, {'original_formula': formulas[index], 'domo_formula': result, 'converted_by': 'llm'}
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": "You are a helpful assistant."},
-                      {"role": "user", "content": f"Convert the following calculation to Domo Beast Mode format: {formula}. Return only the beast mode calculation.Avoid additional text."}]
+        # Cached templates are answered here rather than on the engine's
+        # workers, so a repeat workbook never waits behind other requests'
+        # model calls; only the misses are batched and submitted.
+        misses = []
+        for template in indexes_by_template:
+            cached = cached_conversion(template)
+            if cached is None:
+                misses.append(template)
+            else:
+                yield from finish(template, cached)
+
+        if CONVERSION_BATCH_SIZE > 1:
+            groups = make_batches(misses, CONVERSION_BATCH_SIZE, CONVERSION_BATCH_TOKENS)
+            convert = lambda group: call_openai_batch(group, deadline)
+        else:
+            groups = [[template] for template in misses]
+            convert = lambda group: [call_openai(group[0], deadline)]
+        for group in groups:
+            pending[conversion_engine.submit(convert, group)] = ('templates', group)
+
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                kind, payload = pending.pop(future)
+                if kind == 'fallback':
+                    result = future.result()
+                    if result is not None:
+                        remaining.discard(payload)
+                        yield payload, dict(result, converted_by='llm')
+                    continue
+
+                for template, result in zip(payload, future.result()):
+                    if result is not None:
+                        yield from finish(template, result['domo_formula'])
+    finally:
+        # Also runs when the consumer stops early, e.g. a streaming client
+        # that disconnected, so batches nobody will read stop using the
+        # engine's workers and rate limits. Calls already running finish.
+        for future in pending:
+            future.cancel()
+    for index in sorted(remaining):
+        yield index, {'original_formula': formulas[index], 'domo_formula': CONVERSION_TIMEOUT, 'converted_by': 'llm'}
+
+def cached_conversion(formula):
+    return conversion_cache.get(conversion_key(formula, OPENAI_MODEL, PROMPT_VERSION))
+
+def call_openai(formula, deadline=None):
+    # The conversion cache is read by the caller, before anything is
+    # queued on the engine; results are written to it here.
+    cache_key = conversion_key(formula, OPENAI_MODEL, PROMPT_VERSION)
+    prompt = f"Convert the following calculation to Domo Beast Mode format: {formula}. Return only the beast mode calculation.Avoid additional text."
+    estimated_tokens = estimate_tokens(prompt)
+    try:
+        response = conversion_engine.call(
+            lambda: get_openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[{"role": "system", "content": "You are a helpful assistant."},
+                          {"role": "user", "content": prompt}]
+            ),
+            estimated_tokens=estimated_tokens,
+            deadline=deadline
         )
+        if getattr(response, 'usage', None) is not None:
+            conversion_engine.tokens.adjust(response.usage.total_tokens - estimated_tokens)
+        record_usage(response, 'single')
         domo_formula = response.choices[0].message.content.strip()
+        conversion_cache.put(cache_key, domo_formula)
         return {'original_formula': formula, 'domo_formula': domo_formula}
+    except DeadlineExceeded:
+        return None
     except Exception as e:
         print(f"Error during OpenAI API call: {e}")
-        return {'original_formula': formula, 'domo_formula': 'Error converting formula'}
-
-
-def extract_joins(datasources):
-    joins_data = [] 
-    for datasource in datasources.findall('datasource'):
-        relationships = datasource.findall('.//relation')  
-        for relation in relationships:
-            join_info = {
-                'left_table': None,
-                'right_table': None,
-                'join_type': relation.get('join', 'No join type'),
-                'on_clause': None
-            }
-
-            left_relation = relation.find('./relation[@join="left"]')  
-            right_relation = relation.find('./relation[@join="right"]')  
-            
-            if left_relation is not None:
-                join_info['left_table'] = left_relation.get('name', 'No left table')
-            if right_relation is not None:
-                join_info['right_table'] = right_relation.get('name', 'No right table')
-
-            
-            clause = relation.find('.//clause/expression')
-            if clause is not None:
-                expressions = clause.findall('expression')
-                if len(expressions) >= 2:
-                    left_expression = expressions[0].get('op')
-                    right_expression = expressions[1].get('op')
-                    join_info['on_clause'] = f"{left_expression} = {right_expression}"
-
-            joins_data.append(join_info)
-
-    return joins_data
-
-
-def extract_relationships(datasource):
-    relationships_data = []
-
-    relationships = datasource.find('.//relationships')  
-    if relationships is not None:
-        for relation in relationships.findall('relationship'):
-            relationship_info = {
-                'left_table': relation.find('first-end-point').attrib.get('object-id', 'No left table'),
-                'right_table': relation.find('second-end-point').attrib.get('object-id', 'No right table'),
-                'on_clause': None  
-            }
-
-            clause = relation.find('expression')
-            if clause is not None:
-                expressions = clause.findall('expression')
-                if len(expressions) >= 2:
-                    left_expression = expressions[0].attrib.get('op', 'No left expression')  
-                    right_expression = expressions[1].attrib.get('op', 'No right expression') 
-                    relationship_info['on_clause'] = f"{left_expression} = {right_expression}"
-
-            relationships_data.append(relationship_info)
-
-    return relationships_data
+        return {'original_formula': formula, 'domo_formula': CONVERSION_ERROR}
+
+def call_openai_batch(formulas, deadline=None):
+    # Converts several formulas with one request. Entries missing from or
+    # malformed in the model's JSON, and every entry of a request the API
+    # rejected (a 4xx such as one formula tripping a content filter), are
+    # retried in halves, down to the single-formula call_openai path. When
+    # the engine ran out of retries on a transient error every formula in
+    # the batch is an error. Returns one result per formula, in order; None
+    # marks a formula that ran out of time.
+    results = [None] * len(formulas)
+    keys = [conversion_key(formula, OPENAI_MODEL, PROMPT_VERSION) for formula in formulas]
+    pending = list(range(len(formulas)))
+
+    if len(pending) == 1:
+        results[0] = call_openai(formulas[0], deadline)
+        return results
+    if not pending:
+        return results
+
+    prompt = batch_prompt([formulas[position] for position in pending])
+    estimated_tokens = estimate_tokens(prompt, COMPLETION_TOKENS_PER_FORMULA * len(pending))
+    converted = {}
+    try:
+        response = conversion_engine.call(
+            lambda: get_openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[{"role": "system", "content": BATCH_SYSTEM_PROMPT},
+                          {"role": "user", "content": prompt}],
+                response_format={"type": "json_object"}
+            ),
+            estimated_tokens=estimated_tokens,
+            deadline=deadline
+        )
+        if getattr(response, 'usage', None) is not None:
+            conversion_engine.tokens.adjust(response.usage.total_tokens - estimated_tokens)
+        record_usage(response, 'batch')
+        converted = parse_batch_response(response.choices[0].message.content, len(pending))
+    except DeadlineExceeded:
+        return results
+    except Exception as e:
+        print(f"Error during batched OpenAI API call: {e}")
+        if is_retryable(e):
+            # The engine's retries ran out; splitting the batch would only
+            # repeat the failing call.
+            for position in pending:
+                results[position] = {'original_formula': formulas[position], 'domo_formula': CONVERSION_ERROR}
+            return results
+
+    missing = []
+    for offset, position in enumerate(pending):
+        if offset in converted:
+            conversion_cache.put(keys[position], converted[offset])
+            results[position] = {'original_formula': formulas[position], 'domo_formula': converted[offset]}
+        else:
+            missing.append(position)
+
+    if missing:
+        half = (len(missing) + 1) // 2
+        for group in (missing[:half], missing[half:]):
+            if not group:
+                continue
+            for position, result in zip(group, call_openai_batch([formulas[p] for p in group], deadline)):
+                results[position] = result
+
+    return results
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    # Accepts either a workbook upload (extracted, then converted unless
+    # convert=false) or a JSON body of calculations to convert.
+    queued = job_store.queued()
+    if queued >= JOB_MAX_QUEUED:
+        response = jsonify({'error': 'Too many queued jobs, try again later', 'queued': queued})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    if 'file' in request.files:
+        file = request.files['file']
+        extension = os.path.splitext(file.filename)[1].lower()
+        if extension not in ('.twb', '.twbx'):
+            return jsonify({'error': 'Invalid file type. Only .twb and .twbx files are allowed.'}), 400
+        UPLOAD_BYTES.observe(request.content_length or 0, kind=extension[1:])
+        os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(JOB_UPLOAD_DIR, uuid.uuid4().hex + extension)
+        file.save(path)
+        convert = request.form.get('convert', 'true').lower() in ('1', 'true', 'yes')
+        job_id = job_store.create('workbook', {'path': path, 'filename': file.filename, 'convert': convert})
+    else:
+        calculations = load_calculations(request.get_json(silent=True) or {})
+        if calculations is None:
+            return jsonify({'error': 'Unknown or expired calculations token'}), 404
+        if not calculations:
+            return jsonify({'error': 'No file or calculations provided'}), 400
+        job_id = job_store.create('convert', {'formulas': [calc['formula'] for calc in calculations],
+                                              'field_types': [calc.get('field_types') for calc in calculations]})
+
+    job_runner.notify()
+    response = jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/jobs/{job_id}',
+        'result_url': f'/jobs/{job_id}/result'
+    })
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response, 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    job['progress'] = {'stage': job.pop('stage'), 'done': job.pop('done'), 'total': job.pop('total')}
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] != DONE:
+        return jsonify({'error': job['error'] or 'Job has not finished', 'status': job['status']}), 409
+    return jsonify(job_store.result(job_id))
+
+def run_workbook_job(params, report):
+    # The upload is kept until the job ends so a job picked up again after
+    # a crash can start over.
+    try:
+        report(stage='extracting')
+        timer = StageTimer()
+        metadata = read_workbook(params['path'], timer=timer)
+        record_extraction(timer)
+        result = {'metadata': metadata}
+        if params['convert']:
+            calculations = metadata['calculations']
+            result['conversions'] = run_conversions([calc['formula'] for calc in calculations], report,
+                                                    [calc.get('field_types') for calc in calculations])
+        return result
+    finally:
+        remove_job_upload(params)
+
+def run_convert_job(params, report):
+    return {'conversions': run_conversions(params['formulas'], report, params.get('field_types'))}
+
+def run_conversions(formulas, report, field_types=None):
+    # Progress is written at most once a second to keep SQLite writes cheap.
+    deadline = time.monotonic() + JOB_DEADLINE_SECONDS
+    results = [None] * len(formulas)
+    report(stage='converting', done=0, total=len(formulas))
+    reported = time.monotonic()
+    for done, (index, result) in enumerate(iter_converted_formulas(formulas, deadline, field_types), 1):
+        results[index] = result
+        if time.monotonic() - reported >= 1:
+            report(done=done)
+            reported = time.monotonic()
+    report(done=len(formulas))
+    return results
+
+def remove_job_upload(params):
+    path = params.get('path')
+    if path and os.path.exists(path):
+        os.remove(path)
+
+job_runner = JobRunner(
+    job_store,
+    {'workbook': run_workbook_job, 'convert': run_convert_job},
+    workers=JOB_WORKERS,
+    cleanup=remove_job_upload
+)
+job_runner.start()
+
+# Time from the first line of this module until the app is ready to serve,
+# reported by /healthz.
+STARTUP_SECONDS = time.perf_counter() - STARTED_AT
+print(f"Startup took {STARTUP_SECONDS:.3f}s")
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'startup_seconds': round(STARTUP_SECONDS, 3), 'secrets_loaded': secrets.loaded()})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import sys
+import time
+import zipfile
+from collections import Counter
+from multiprocessing import Pool
+
+from twb_extract import STREAM_THRESHOLD_BYTES, read_twb_metadata
+from twbx_archive import check_member, find_root_twb
+
+# Extracts metadata from a whole estate of workbooks without the web app:
+#   python batch_extract.py workbooks/ --output estate.jsonl
+#   python batch_extract.py --manifest paths.txt --output estate.jsonl --workers 8
+# Each workbook produces one JSON line. Re-running with the same output file
+# skips workbooks that already have a record, so an interrupted run resumes
+# where it stopped.
+
+WORKBOOK_EXTENSIONS = ('.twb', '.twbx')
+
+
+def find_workbooks(paths, manifest=None):
+    paths = list(paths)
+    if manifest:
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    paths.append(line)
+
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(WORKBOOK_EXTENSIONS):
+                        found.append(os.path.join(root, name))
+        else:
+            found.append(path)
+
+    # A workbook listed twice, or reached through both a directory and the
+    # manifest, is only extracted once.
+    seen = set()
+    workbooks = []
+    for path in found:
+        path = os.path.abspath(path)
+        if path not in seen:
+            seen.add(path)
+            workbooks.append(path)
+    return workbooks
+
+
+def read_workbook(path, timer=None):
+    if path.lower().endswith('.twbx'):
+        with zipfile.ZipFile(path) as z:
+            info = find_root_twb(z)
+            if info is None:
+                raise ValueError('No .twb file found inside the .twbx archive')
+            check_member(info)
+            with z.open(info) as twb_file:
+                return read_twb_metadata(twb_file, stream=info.file_size >= STREAM_THRESHOLD_BYTES, timer=timer)
+    if path.lower().endswith('.twb'):
+        return read_twb_metadata(path, stream=os.path.getsize(path) >= STREAM_THRESHOLD_BYTES, timer=timer)
+    raise ValueError('Only .twb and .twbx files are supported')
+
+
+def extract_file(path):
+    # Runs in a worker process. Errors are recorded rather than raised so one
+    # broken workbook never stops the run.
+    start = time.perf_counter()
+    record = {'path': path}
+    try:
+        record['metadata'] = read_workbook(path)
+        record['status'] = 'ok'
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def read_records(output):
+    if not os.path.exists(output):
+        return
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run; its workbook is
+                # extracted again.
+                continue
+
+
+def ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def completed_paths(output, retry_errors=False):
+    completed = set()
+    for record in read_records(output):
+        if record.get('status') == 'ok' or not retry_errors:
+            completed.add(record['path'])
+        else:
+            completed.discard(record['path'])
+    return completed
+
+
+def summarize(output):
+    # Aggregates over every record in the output file, including those
+    # written by earlier, resumed runs. The last record for a path wins.
+    workbooks = {}
+    for record in read_records(output):
+        summary = {'status': record['status'], 'seconds': record.get('seconds', 0)}
+        metadata = record.get('metadata')
+        if metadata is not None:
+            summary['datasources'] = len(metadata['datasources'])
+            summary['connection_types'] = [ds['Connection Type'] for ds in metadata['datasources']]
+            summary['calculations'] = len(metadata['calculations'])
+            summary['parameters'] = len(metadata['parameters'])
+            summary['worksheets'] = len(metadata['worksheets'])
+            summary['dashboards'] = len(metadata['dashboards'])
+        workbooks[record['path']] = summary
+
+    totals = Counter()
+    connection_types = Counter()
+    calculation_counts = []
+    for path, summary in workbooks.items():
+        totals[summary['status']] += 1
+        totals['seconds'] += summary['seconds']
+        if summary['status'] != 'ok':
+            continue
+        for key in ('datasources', 'calculations', 'parameters', 'worksheets', 'dashboards'):
+            totals[key] += summary[key]
+        connection_types.update(summary['connection_types'])
+        calculation_counts.append((summary['calculations'], path))
+
+    calculation_counts.sort(reverse=True)
+    return {
+        'workbooks': len(workbooks),
+        'succeeded': totals['ok'],
+        'failed': totals['error'],
+        'extraction_seconds': round(totals['seconds'], 2),
+        'datasources': totals['datasources'],
+        'calculations': totals['calculations'],
+        'parameters': totals['parameters'],
+        'worksheets': totals['worksheets'],
+        'dashboards': totals['dashboards'],
+        'connection_types': dict(connection_types.most_common()),
+        'most_calculations': [{'path': path, 'calculations': count} for count, path in calculation_counts[:10]],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract metadata from many Tableau workbooks into a JSONL file.')
+    parser.add_argument('paths', nargs='*', help='.twb/.twbx files or directories to search')
+    parser.add_argument('--manifest', help='file listing one workbook path per line')
+    parser.add_argument('--output', required=True, help='JSONL file to append records to')
+    parser.add_argument('--summary', help='also write the aggregate summary to this JSON file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: CPU count)')
+    parser.add_argument('--chunksize', type=int, default=4, help='workbooks handed to a worker at a time')
+    parser.add_argument('--retry-errors', action='store_true', help='extract workbooks that failed in an earlier run again')
+    args = parser.parse_args(argv)
+
+    if not args.paths and not args.manifest:
+        parser.error('give at least one path or --manifest')
+
+    workbooks = find_workbooks(args.paths, args.manifest)
+    completed = completed_paths(args.output, args.retry_errors)
+    pending = [path for path in workbooks if path not in completed]
+    print(f"{len(workbooks)} workbooks, {len(workbooks) - len(pending)} already done, {len(pending)} to extract",
+          file=sys.stderr)
+
+    start = time.perf_counter()
+    if pending:
+        # Records are written in completion order and flushed one by one so
+        # a resumed run loses at most the workbooks that were in flight.
+        with open(args.output, 'a', encoding='utf-8') as out, Pool(args.workers) as pool:
+            if out.tell() and not ends_with_newline(args.output):
+                out.write('\n')
+            for done, record in enumerate(pool.imap_unordered(extract_file, pending, args.chunksize), 1):
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+                if record['status'] != 'ok':
+                    print(f"[{done}/{len(pending)}] {record['path']}: {record['error']}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(args.output)
+    summary['elapsed_seconds'] = round(elapsed, 2)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
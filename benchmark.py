@@ -0,0 +1,245 @@
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from synthetic_workbook import write_workbook
+
+# Benchmarks extraction and conversion on synthetic workbooks:
+#   python benchmark.py --save-baseline benchmark_baseline.json
+#   python benchmark.py --baseline benchmark_baseline.json
+# The second run exits with status 1 when a case got slower, or used more
+# memory, than the baseline by more than --tolerance. Baselines are only
+# comparable on the same machine.
+#
+# Conversion runs drive /convert_to_domo through the Flask test client
+# against mock_openai, so they measure this app's batching, caching and
+# retry overhead rather than the model.
+
+WORKBOOK_SIZES = {
+    'small': {'datasources': 2, 'records': 500, 'calculations': 50, 'calc_depth': 3,
+              'join_tables': 3, 'worksheets': 10, 'dashboards': 2, 'zones': 6},
+    'medium': {'datasources': 4, 'records': 5000, 'calculations': 300, 'calc_depth': 6,
+               'join_tables': 6, 'worksheets': 60, 'dashboards': 10, 'zones': 12},
+    'large': {'datasources': 8, 'records': 20000, 'calculations': 1500, 'calc_depth': 10,
+              'join_tables': 12, 'worksheets': 200, 'dashboards': 40, 'zones': 20},
+}
+
+# Metrics where a larger value is an improvement; for every other metric a
+# larger value is a regression.
+HIGHER_IS_BETTER = ('formulas_per_second',)
+
+
+def measure(fn, repeats):
+    # Best and median wall time over the repeats, then one more run under
+    # tracemalloc for the peak of Python allocations. Memory held by C
+    # libraries (lxml's tree, for one) is not included.
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': round(min(times), 4), 'median_seconds': round(statistics.median(times), 4),
+            'peak_mb': round(peak / 1024 / 1024, 2)}
+
+
+def load_app(directory, base_url):
+    # Imported on demand: the app reads its settings from the environment
+    # at import time. Rate limits are lifted so the mock's latency, not the
+    # limiter, bounds throughput. The caches and job queue live in
+    # directory, and no job workers run, so a benchmark on the same host
+    # as the app never touches the app's jobs or uploads.
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ['CONVERSION_CACHE_PATH'] = os.path.join(directory, 'conversions.db')
+    os.environ['JOB_DB_PATH'] = os.path.join(directory, 'jobs.db')
+    os.environ['JOB_UPLOAD_DIR'] = os.path.join(directory, 'uploads')
+    os.environ['JOB_WORKERS'] = '0'
+    os.environ.setdefault('SECRETS_PROVIDER', 'env')
+    os.environ.setdefault('OPEN_AI_API_KEY', 'benchmark')
+    os.environ.setdefault('APP_SECRET_KEY', 'benchmark')
+    os.environ.setdefault('SECRETS_PREFETCH', 'false')
+    os.environ.setdefault('OPENAI_REQUESTS_PER_MINUTE', '1000000')
+    os.environ.setdefault('OPENAI_TOKENS_PER_MINUTE', '1000000000')
+    import app2
+
+    os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+    app2.app.config['TESTING'] = True
+    # Builds the client (and imports the SDK) before anything is timed.
+    app2.get_openai_client()
+    return app2
+
+
+def extraction_cases(directory, sizes, repeats, app=None):
+    from batch_extract import read_workbook
+    from metadata_cache import MetadataCache
+    from twb_extract import extract_twb_metadata, stream_twb_metadata
+
+    results = {}
+    for size in sizes:
+        twb = write_workbook(os.path.join(directory, f'{size}.twb'), **WORKBOOK_SIZES[size])
+        twbx = write_workbook(os.path.join(directory, f'{size}.twbx'), **WORKBOOK_SIZES[size])
+        with open(twb, 'rb') as f:
+            data = f.read()
+        megabytes = round(len(data) / 1024 / 1024, 2)
+
+        cases = {
+            'tree': lambda: extract_twb_metadata(twb),
+            'stream': lambda: stream_twb_metadata(twb),
+            'twbx': lambda: read_workbook(twbx),
+        }
+        if app is not None:
+            client = app.app.test_client()
+
+            def upload():
+                # A fresh cache every time, so each upload really extracts.
+                app.metadata_cache = MetadataCache()
+                response = client.post('/extract_metadata', data={'file': (io.BytesIO(data), f'{size}.twb')},
+                                       content_type='multipart/form-data')
+                assert response.status_code == 200, response.get_data(as_text=True)
+
+            cases['upload'] = upload
+
+        for name, fn in cases.items():
+            result = measure(fn, repeats)
+            result['workbook_mb'] = megabytes
+            results[f'extract/{size}/{name}'] = result
+            print(f"extract/{size}/{name}: {result}", file=sys.stderr)
+    return results
+
+
+def conversion_cases(app, server, counts, directory):
+    from conversion_cache import ConversionCache
+    from synthetic_workbook import FORMULAS
+
+    results = {}
+    client = app.app.test_client()
+    for run, count in enumerate(counts):
+        # A fresh cache and never-seen formulas, so every one is converted.
+        app.conversion_cache = ConversionCache(os.path.join(directory, f'conversions-{run}.db'))
+        calculations = [
+            {'name': f'Calc {number}', 'formula': FORMULAS[number % len(FORMULAS)].format(ref=f'[Field {number}]', n=number)}
+            for number in range(count)
+        ]
+        before = dict(server.settings.stats)
+        retries = app.conversion_engine.retries
+        start = time.perf_counter()
+        response = client.post('/convert_to_domo', json={'calculations': calculations})
+        seconds = time.perf_counter() - start
+        assert response.status_code == 200, response.get_data(as_text=True)
+        converted = response.get_json()
+
+        result = {
+            'seconds': round(seconds, 4),
+            'formulas_per_second': round(count / seconds, 1),
+            'requests': server.settings.stats['requests'] - before['requests'],
+            'retries': app.conversion_engine.retries - retries,
+            'errors': sum(1 for item in converted if item['domo_formula'] == app.CONVERSION_ERROR),
+            'timed_out': sum(1 for item in converted if item['domo_formula'] == app.CONVERSION_TIMEOUT),
+            'by_rules': sum(1 for item in converted if item['converted_by'] == 'rules'),
+        }
+        results[f'convert/{count}'] = result
+        print(f"convert/{count}: {result}", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Returns one message per metric that moved the wrong way by more than
+    # the tolerance. Counters such as requests or retries are reported but
+    # never compared.
+    regressions = []
+    for case, metrics in results['cases'].items():
+        previous = baseline.get('cases', {}).get(case)
+        if previous is None:
+            continue
+        for metric in ('seconds', 'peak_mb', 'formulas_per_second'):
+            if metric not in metrics or not previous.get(metric):
+                continue
+            ratio = metrics[metric] / previous[metric]
+            worse = ratio < 1 - tolerance if metric in HIGHER_IS_BETTER else ratio > 1 + tolerance
+            if worse:
+                regressions.append(f"{case} {metric}: {previous[metric]} -> {metrics[metric]} ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark extraction and conversion on synthetic workbooks.')
+    parser.add_argument('--sizes', default='small,medium', help=f"comma-separated, from {', '.join(WORKBOOK_SIZES)}")
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per extraction case')
+    parser.add_argument('--conversions', default='50,500', help='comma-separated formula counts; empty to skip')
+    parser.add_argument('--latency', type=float, default=0.2, help='mock OpenAI seconds per request')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.02)
+    parser.add_argument('--drop-rate', type=float, default=0.05, help='share of batch entries the mock leaves out')
+    parser.add_argument('--no-app', action='store_true', help='skip cases that load app2 (uploads and conversions)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this results file')
+    parser.add_argument('--save-baseline', help='write the results to this file as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative change before flagging')
+    args = parser.parse_args(argv)
+
+    sizes = [size for size in args.sizes.split(',') if size]
+    unknown = [size for size in sizes if size not in WORKBOOK_SIZES]
+    if unknown:
+        parser.error(f"unknown size: {', '.join(unknown)}")
+    counts = [int(count) for count in args.conversions.split(',') if count]
+
+    from mock_openai import MockSettings, start_server
+    from xml_backend import BACKEND
+
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor_count': os.cpu_count(),
+        'xml_backend': BACKEND,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cases': {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        app = server = None
+        if not args.no_app:
+            server = start_server(MockSettings(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                               rate_limit_rate=args.rate_limit_rate, drop_rate=args.drop_rate))
+            app = load_app(directory, server.base_url)
+        results['cases'].update(extraction_cases(directory, sizes, args.repeats, app))
+        if app is not None and counts:
+            results['mock'] = {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+                               'rate_limit_rate': args.rate_limit_rate, 'drop_rate': args.drop_rate}
+            results['cases'].update(conversion_cases(app, server, counts, directory))
+        if server is not None:
+            server.shutdown()
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import os
+import re
+
+# A bracketed Tableau field reference such as [Calculation_123] or
+# [Profit Ratio]; a literal ']' inside a name is escaped as ']]'.
+FIELD_REFERENCE = re.compile(r'\[(?:[^\]]|\]\])*\]')
+
+# Inlining a calculation that references the same dependency more than once
+# doubles its size at every level, so a few KB of workbook can expand to
+# gigabytes. References that would take a formula past this many characters
+# are left as they are.
+MAX_INLINED_FORMULA_LENGTH = int(os.getenv('MAX_INLINED_FORMULA_LENGTH', 20000))
+
+
+def build_calculation_graph(calculation_mapping):
+    graph = {}
+    for name, formula in calculation_mapping.items():
+        dependencies = dict.fromkeys(
+            ref for ref in FIELD_REFERENCE.findall(formula) if ref in calculation_mapping
+        )
+        graph[name] = list(dependencies)
+    return graph
+
+
+def order_calculations(graph):
+    # Depth-first post-order, so every calculation comes after the ones it
+    # references. A reference back to a calculation still on the current
+    # path closes a cycle; that edge is reported and left unresolved.
+    order = []
+    cycles = []
+    state = {}
+
+    for start in graph:
+        if start in state:
+            continue
+        state[start] = 'visiting'
+        path = [start]
+        stack = [iter(graph[start])]
+        while stack:
+            for dependency in stack[-1]:
+                dependency_state = state.get(dependency)
+                if dependency_state is None:
+                    state[dependency] = 'visiting'
+                    path.append(dependency)
+                    stack.append(iter(graph[dependency]))
+                    break
+                if dependency_state == 'visiting':
+                    cycles.append(path[path.index(dependency):])
+            else:
+                stack.pop()
+                done = path.pop()
+                state[done] = 'done'
+                order.append(done)
+
+    return order, cycles
+
+
+def resolve_formula(formula, resolved, max_length=MAX_INLINED_FORMULA_LENGTH):
+    # Returns (formula, unresolved): references are substituted left to
+    # right while the result stays within max_length; the ones that did not
+    # fit are left in place and listed in unresolved.
+    length = len(formula)
+    unresolved = []
+
+    def substitute(match):
+        nonlocal length
+        ref = match.group(0)
+        if ref not in resolved:
+            return ref
+        growth = len(resolved[ref]) + 2 - len(ref)
+        if length + growth > max_length:
+            if ref not in unresolved:
+                unresolved.append(ref)
+            return ref
+        length += growth
+        return f"({resolved[ref]})"
+
+    return FIELD_REFERENCE.sub(substitute, formula), unresolved
+
+
+def resolve_calculations(calculation_mapping, graph, order):
+    # Returns (resolved, unresolved), where unresolved maps a calculation
+    # to the references left in it by the length cap.
+    resolved = {}
+    unresolved = {}
+    for name in order:
+        formula = calculation_mapping[name]
+        if graph[name]:
+            formula, refs = resolve_formula(formula, resolved)
+            if refs:
+                unresolved[name] = refs
+        resolved[name] = formula
+    return resolved, unresolved
@@ -0,0 +1,67 @@
+import json
+
+from conversion_engine import estimate_tokens
+
+BATCH_SYSTEM_PROMPT = "You convert Tableau calculations to Domo Beast Mode calculations."
+
+BATCH_INSTRUCTIONS = (
+    "Convert each of the following Tableau calculations to Domo Beast Mode format. "
+    "Respond with a JSON object of the form "
+    '{"results": [{"id": "<id>", "beast_mode": "<beast mode calculation>"}]} '
+    "containing exactly one entry per input id and no other text.\n"
+)
+
+# Completion tokens reserved per formula when estimating a batch's cost.
+COMPLETION_TOKENS_PER_FORMULA = 128
+
+
+def make_batches(formulas, max_items=20, max_tokens=4000):
+    # Groups formulas into batches bounded both by count and by estimated
+    # prompt tokens. A formula larger than the budget gets a batch of its own.
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for formula in formulas:
+        tokens = estimate_tokens(formula, COMPLETION_TOKENS_PER_FORMULA)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(formula)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_prompt(formulas):
+    items = [{'id': str(index), 'formula': formula} for index, formula in enumerate(formulas, 1)]
+    return BATCH_INSTRUCTIONS + json.dumps(items, indent=1)
+
+
+def parse_batch_response(content, count):
+    # Returns {position: beast_mode} for every well-formed entry. Unknown,
+    # duplicate, empty or malformed entries are dropped so the caller
+    # retries only the positions that are missing.
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return {}
+    results = data.get('results') if isinstance(data, dict) else data
+    if not isinstance(results, list):
+        return {}
+
+    converted = {}
+    for item in results:
+        if not isinstance(item, dict):
+            continue
+        beast_mode = item.get('beast_mode')
+        try:
+            position = int(item.get('id')) - 1
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= position < count or position in converted:
+            continue
+        if isinstance(beast_mode, str) and beast_mode.strip():
+            converted[position] = beast_mode.strip()
+    return converted
@@ -0,0 +1,95 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+# String literals are kept verbatim; whitespace elsewhere is insignificant.
+STRING_LITERAL = re.compile(r'"(?:[^"]|"")*"|\'(?:[^\']|\'\')*\'')
+WHITESPACE = re.compile(r'[ \t\f\v]+')
+
+
+def normalize_formula(formula):
+    # Collapses runs of whitespace outside string literals and drops blank
+    # lines. Line breaks are kept because a '//' comment ends at one.
+    parts = []
+    last = 0
+    for match in STRING_LITERAL.finditer(formula):
+        parts.append(WHITESPACE.sub(' ', formula[last:match.start()]))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(WHITESPACE.sub(' ', formula[last:]))
+    lines = ''.join(parts).replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.strip() for line in lines if line.strip())
+
+
+def conversion_key(formula, model, prompt_version):
+    text = '\0'.join((model, prompt_version, normalize_formula(formula)))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ConversionCache:
+    def __init__(self, path, ttl_seconds=30 * 24 * 3600, max_entries=100000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS conversions ('
+            'key TEXT PRIMARY KEY, domo_formula TEXT NOT NULL, '
+            'created_at REAL NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS conversions_last_used ON conversions (last_used)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS conversions_created_at ON conversions (created_at)')
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT domo_formula, created_at FROM conversions WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute('DELETE FROM conversions WHERE key = ?', (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE conversions SET last_used = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, domo_formula):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO conversions (key, domo_formula, created_at, last_used) '
+                'VALUES (?, ?, ?, ?)', (key, domo_formula, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM conversions').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'max_entries': self.max_entries,
+            }
+
+    def _evict(self, now):
+        self._conn.execute('DELETE FROM conversions WHERE created_at < ?', (now - self.ttl_seconds,))
+        overflow = self._conn.execute('SELECT COUNT(*) FROM conversions').fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                'DELETE FROM conversions WHERE key IN '
+                '(SELECT key FROM conversions ORDER BY last_used LIMIT ?)', (overflow,)
+            )
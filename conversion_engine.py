@@ -0,0 +1,130 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Counter, Histogram
+
+OPENAI_REQUEST_SECONDS = Histogram(
+    'tableau_accelerator_openai_request_seconds',
+    'Latency of each OpenAI API attempt, by outcome.',
+    ('outcome',)
+)
+OPENAI_RETRIES = Counter('tableau_accelerator_openai_retries_total', 'OpenAI API calls retried after an error.')
+OPENAI_RATE_LIMIT_WAIT_SECONDS = Histogram(
+    'tableau_accelerator_openai_rate_limit_wait_seconds',
+    'Time spent waiting on the client-side request and token budgets before an OpenAI API attempt.'
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def estimate_tokens(prompt, completion_tokens=256):
+    # Rough pre-call estimate (about four characters per token) used to
+    # reserve tokens-per-minute budget; corrected from the reported usage.
+    return len(prompt) // 4 + completion_tokens
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1, deadline=None):
+        # Requests larger than the bucket are clamped so they can still run
+        # once the bucket is full.
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._available >= amount:
+                    self._available -= amount
+                    return
+                wait_seconds = (amount - self._available) / self.rate
+            if deadline is not None and now + wait_seconds > deadline:
+                raise DeadlineExceeded()
+            time.sleep(wait_seconds)
+
+    def adjust(self, amount):
+        # Corrects an earlier estimate once the real cost is known; the
+        # balance may go negative, which delays later callers.
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available = min(self.capacity, self._available - amount)
+
+
+def is_retryable(error):
+    # Imported here so that loading the engine does not pull in the SDK.
+    import openai
+
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class ConversionEngine:
+    # One instance per process. Every OpenAI call goes through its worker
+    # pool, so concurrency and rate limits hold across all requests.
+    def __init__(self, max_workers=8, requests_per_minute=500, tokens_per_minute=30000,
+                 max_retries=5, base_delay=0.5, max_delay=30.0):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.retries = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='conversion')
+
+    def call(self, fn, estimated_tokens=0, deadline=None):
+        attempt = 0
+        while True:
+            with OPENAI_RATE_LIMIT_WAIT_SECONDS.time():
+                self.requests.acquire(1, deadline)
+                if estimated_tokens:
+                    self.tokens.acquire(estimated_tokens, deadline)
+            start = time.perf_counter()
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = is_retryable(e)
+                OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                               outcome='retryable_error' if retryable else 'error')
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                # Exponential backoff with full jitter, never shorter than
+                # what the server asked for (which may be 0).
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                delay = max(delay, retry_after(e) or 0.0)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise DeadlineExceeded() from e
+                attempt += 1
+                self.retries += 1
+                OPENAI_RETRIES.inc()
+                time.sleep(delay)
+            else:
+                OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome='ok')
+                return result
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
@@ -0,0 +1,108 @@
+import re
+import sys
+import time
+
+from conversion_cache import normalize_formula
+
+# A field reference, optionally qualified: [Sales], [Parameters].[Growth].
+# A literal ']' inside a name is escaped as ']]'.
+FIELD_REFERENCE = r'\[(?:[^\]]|\]\])*\](?:\.\[(?:[^\]]|\]\])*\])*'
+
+# String literals and comments are matched first so that bracketed text
+# inside them is never mistaken for a field reference.
+TOKEN = re.compile(r'"(?:[^"]|"")*"|\'(?:[^\']|\'\')*\'|//[^\n]*|' + FIELD_REFERENCE)
+
+# Placeholders as they may come back from the model: Tableau brackets or
+# Beast Mode backticks.
+PLACEHOLDER = re.compile(r'\[Field_(\d+)\]|`Field_(\d+)`')
+STRAY_PLACEHOLDER = re.compile(r'\bField_\d+\b')
+
+
+def field_references(formula):
+    # Field references in order of first use, ignoring bracketed text
+    # inside string literals and comments.
+    references = []
+    for match in TOKEN.finditer(formula):
+        token = match.group(0)
+        if token[0] == '[' and token not in references:
+            references.append(token)
+    return references
+
+
+def templatize(formula, field_types=None):
+    # Returns the formula with every field reference replaced by a numbered
+    # placeholder, plus the references in placeholder order. Formulas that
+    # differ only in the fields they use share a template.
+    #
+    # Tableau's + and - depend on the operands' types ([First Name] +
+    # [Last Name] joins strings, [Sales] + [Profit] adds numbers), so the
+    # datatypes from field_types, keyed by reference, end the template as a
+    # comment that the model sees too. A formula using a field of unknown
+    # type is its own template.
+    references = field_references(formula)
+    if any(not (field_types or {}).get(reference) for reference in references):
+        return normalize_formula(formula), []
+    fields = {reference: f"[Field_{number}]" for number, reference in enumerate(references, 1)}
+
+    def replace(match):
+        token = match.group(0)
+        return fields[token] if token[0] == '[' else token
+
+    template = normalize_formula(TOKEN.sub(replace, formula))
+    if references:
+        types = ', '.join(f"{fields[reference]} {field_types[reference]}" for reference in references)
+        template += f"\n// Field types: {types}"
+    return template, references
+
+
+def field_name(reference):
+    last = reference[reference.rfind('.[') + 1:] if '.[' in reference else reference
+    return last[1:-1].replace(']]', ']')
+
+
+def restore(converted, fields):
+    # Puts the original field references back into a converted template.
+    # Returns None when the model output uses a placeholder that cannot be
+    # mapped back, so the caller can convert the original formula instead.
+    missing = []
+
+    def replace(match):
+        index = int(match.group(1) or match.group(2)) - 1
+        if index >= len(fields):
+            missing.append(match.group(0))
+            return match.group(0)
+        if match.group(1):
+            return fields[index]
+        return f"`{field_name(fields[index])}`"
+
+    restored = PLACEHOLDER.sub(replace, converted)
+    if missing or STRAY_PLACEHOLDER.search(PLACEHOLDER.sub('', converted)):
+        return None
+    return restored
+
+
+def summarize(calculations):
+    formulas = [calc['formula'] for calc in calculations]
+    start = time.perf_counter()
+    templates = set(templatize(calc['formula'], calc.get('field_types'))[0] for calc in calculations)
+    elapsed = time.perf_counter() - start
+    return {
+        'formulas': len(formulas),
+        'distinct_formulas': len(set(normalize_formula(formula) for formula in formulas)),
+        'distinct_templates': len(templates),
+        'templatize_us_per_formula': elapsed / len(formulas) * 1e6 if formulas else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    # Reports how much structural deduplication saves on real workbooks:
+    #   python formula_templates.py workbook.twb [workbook.twb ...]
+    from twb_extract import extract_twb_metadata
+
+    all_calculations = []
+    for path in sys.argv[1:]:
+        calculations = extract_twb_metadata(path)['calculations']
+        all_calculations.extend(calculations)
+        print(path, summarize(calculations))
+    if len(sys.argv) > 2:
+        print('total', summarize(all_calculations))
@@ -0,0 +1,381 @@
+import re
+
+# Deterministic Tableau -> Domo Beast Mode conversion for the common subset
+# of the calculation language. Anything outside that subset (LOD
+# expressions, table calculations, parameters, unknown functions) raises
+# UnsupportedFormula so the caller can fall back to the LLM.
+
+
+class UnsupportedFormula(Exception):
+    pass
+
+
+TOKEN = re.compile(r'''
+    (?P<space>\s+|//[^\n]*)
+  | (?P<field>\[(?:[^\]]|\]\])*\](?:\.\[(?:[^\]]|\]\])*\])*)
+  | (?P<string>"(?:[^"]|"")*"|'(?:[^']|'')*')
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>==|!=|<>|<=|>=|[-+*/%^=<>(),])
+''', re.VERBOSE)
+
+KEYWORDS = {'IF', 'THEN', 'ELSEIF', 'ELSE', 'END', 'CASE', 'WHEN', 'AND', 'OR', 'NOT', 'IN',
+            'TRUE', 'FALSE', 'NULL'}
+
+COMPARISONS = {'==': '=', '=': '=', '!=': '<>', '<>': '<>', '<': '<', '>': '>', '<=': '<=', '>=': '>='}
+
+# Binding strength of emitted SQL, used to decide where parentheses go.
+PREC_OR, PREC_AND, PREC_NOT, PREC_COMPARE, PREC_ADD, PREC_MUL, PREC_NEG, PREC_ATOM = range(1, 9)
+
+
+def tokenize(formula):
+    tokens = []
+    position = 0
+    while position < len(formula):
+        match = TOKEN.match(formula, position)
+        if match is None:
+            raise UnsupportedFormula(f"Unsupported character {formula[position]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        text = match.group(0)
+        if kind == 'name' and text.upper() in KEYWORDS:
+            tokens.append(('keyword', text.upper()))
+        elif kind == 'name':
+            tokens.append(('name', text.upper()))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+
+class Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def accept(self, kind, text=None):
+        token = self.peek()
+        if token[0] == kind and (text is None or token[1] == text):
+            self.position += 1
+            return token
+        return None
+
+    def expect(self, kind, text=None):
+        token = self.accept(kind, text)
+        if token is None:
+            raise UnsupportedFormula(f"Expected {text or kind}, found {self.peek()[1]!r}")
+        return token
+
+    def parse(self):
+        node = self.expression()
+        if self.peek()[0] is not None:
+            raise UnsupportedFormula(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def expression(self):
+        node = self.conjunction()
+        while self.accept('keyword', 'OR'):
+            node = ('binary', 'OR', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.accept('keyword', 'AND'):
+            node = ('binary', 'AND', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.accept('keyword', 'NOT'):
+            return ('not', self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        node = self.additive()
+        token = self.peek()
+        if token[0] == 'op' and token[1] in COMPARISONS:
+            self.next()
+            return ('binary', COMPARISONS[token[1]], node, self.additive())
+        if self.accept('keyword', 'IN'):
+            self.expect('op', '(')
+            items = [self.additive()]
+            while self.accept('op', ','):
+                items.append(self.additive())
+            self.expect('op', ')')
+            return ('in', node, items)
+        return node
+
+    def additive(self):
+        node = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            node = ('binary', self.next()[1], node, self.term())
+        return node
+
+    def term(self):
+        node = self.power()
+        while self.peek() in (('op', '*'), ('op', '/'), ('op', '%')):
+            node = ('binary', self.next()[1], node, self.power())
+        return node
+
+    def power(self):
+        # Negation binds tighter than '^' in Tableau; '^' is right associative.
+        node = self.negative()
+        if self.accept('op', '^'):
+            return ('call', 'POWER', [node, self.power()])
+        return node
+
+    def negative(self):
+        if self.accept('op', '-'):
+            return ('negate', self.negative())
+        return self.primary()
+
+    def primary(self):
+        kind, text = self.next()
+        if kind == 'number':
+            return ('number', text)
+        if kind == 'string':
+            return ('string', text[1:-1].replace(text[0] * 2, text[0]))
+        if kind == 'field':
+            return ('field', text)
+        if kind == 'keyword' and text in ('TRUE', 'FALSE'):
+            return ('boolean', text)
+        if kind == 'keyword' and text == 'NULL':
+            return ('null',)
+        if kind == 'keyword' and text == 'IF':
+            return self.if_expression()
+        if kind == 'keyword' and text == 'CASE':
+            return self.case_expression()
+        if kind == 'op' and text == '(':
+            node = self.expression()
+            self.expect('op', ')')
+            return node
+        if kind == 'name':
+            self.expect('op', '(')
+            args = []
+            if not self.accept('op', ')'):
+                args.append(self.expression())
+                while self.accept('op', ','):
+                    args.append(self.expression())
+                self.expect('op', ')')
+            return ('call', text, args)
+        raise UnsupportedFormula(f"Unexpected {text!r}")
+
+    def if_expression(self):
+        branches = [(self.expression(), self.expect('keyword', 'THEN') and self.expression())]
+        while self.accept('keyword', 'ELSEIF'):
+            branches.append((self.expression(), self.expect('keyword', 'THEN') and self.expression()))
+        otherwise = self.expression() if self.accept('keyword', 'ELSE') else None
+        self.expect('keyword', 'END')
+        return ('if', branches, otherwise)
+
+    def case_expression(self):
+        subject = self.expression()
+        branches = []
+        while self.accept('keyword', 'WHEN'):
+            branches.append((self.expression(), self.expect('keyword', 'THEN') and self.expression()))
+        if not branches:
+            raise UnsupportedFormula("CASE without WHEN")
+        otherwise = self.expression() if self.accept('keyword', 'ELSE') else None
+        self.expect('keyword', 'END')
+        return ('case', subject, branches, otherwise)
+
+
+def wrap(emitted, precedence):
+    sql, kind, own = emitted
+    return f"({sql})" if own < precedence else sql
+
+
+def emit_field(text):
+    parts = re.findall(r'\[((?:[^\]]|\]\])*)\]', text)
+    if len(parts) > 1 and parts[0].lower() == 'parameters':
+        raise UnsupportedFormula("Parameters have no Beast Mode equivalent")
+    name = parts[-1].replace(']]', ']')
+    if re.fullmatch(r'Calculation_\d+', name):
+        raise UnsupportedFormula("Unresolved calculated field reference")
+    return '`' + name.replace('`', '``') + '`'
+
+
+def emit_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+# No 'week': Tableau counts the week holding Jan 1 as week 1, MySQL's
+# WEEK() the first week starting on a Sunday, so they differ in most years.
+DATEPART_FUNCTIONS = {
+    'year': 'YEAR', 'quarter': 'QUARTER', 'month': 'MONTH',
+    'day': 'DAYOFMONTH', 'weekday': 'DAYOFWEEK', 'dayofyear': 'DAYOFYEAR',
+    'hour': 'HOUR', 'minute': 'MINUTE', 'second': 'SECOND',
+}
+
+DATETRUNC_TEMPLATES = {
+    'year': "DATE(DATE_FORMAT({0}, '%Y-01-01'))",
+    'quarter': "DATE_SUB(DATE(DATE_FORMAT({0}, '%Y-%m-01')), INTERVAL (MONTH({0}) - 1) % 3 MONTH)",
+    'month': "DATE(DATE_FORMAT({0}, '%Y-%m-01'))",
+    'week': "DATE_SUB(DATE({0}), INTERVAL DAYOFWEEK({0}) - 1 DAY)",
+    'day': "DATE({0})",
+}
+
+# Functions whose Beast Mode spelling differs at most in name, with the
+# accepted argument counts and the type of their result.
+SIMPLE_FUNCTIONS = {
+    'SUM': ('SUM', (1,), 'number'),
+    'AVG': ('AVG', (1,), 'number'),
+    'COUNT': ('COUNT', (1,), 'number'),
+    'ABS': ('ABS', (1,), 'number'),
+    'ROUND': ('ROUND', (1, 2), 'number'),
+    'CEILING': ('CEILING', (1,), 'number'),
+    'FLOOR': ('FLOOR', (1,), 'number'),
+    'SQRT': ('SQRT', (1,), 'number'),
+    'POWER': ('POWER', (2,), 'number'),
+    'EXP': ('EXP', (1,), 'number'),
+    'SIGN': ('SIGN', (1,), 'number'),
+    'LEN': ('CHAR_LENGTH', (1,), 'number'),
+    'FIND': ('INSTR', (2,), 'number'),
+    'LEFT': ('LEFT', (2,), 'string'),
+    'RIGHT': ('RIGHT', (2,), 'string'),
+    'MID': ('SUBSTRING', (2, 3), 'string'),
+    'UPPER': ('UPPER', (1,), 'string'),
+    'LOWER': ('LOWER', (1,), 'string'),
+    'TRIM': ('TRIM', (1,), 'string'),
+    'LTRIM': ('LTRIM', (1,), 'string'),
+    'RTRIM': ('RTRIM', (1,), 'string'),
+    'REPLACE': ('REPLACE', (3,), 'string'),
+    'YEAR': ('YEAR', (1,), 'number'),
+    'QUARTER': ('QUARTER', (1,), 'number'),
+    'MONTH': ('MONTH', (1,), 'number'),
+    'DAY': ('DAYOFMONTH', (1,), 'number'),
+    'TODAY': ('CURRENT_DATE', (0,), 'date'),
+    'NOW': ('NOW', (0,), 'date'),
+}
+
+
+def emit_call(name, args):
+    if name in ('MIN', 'MAX'):
+        if len(args) == 1:
+            sql, kind, _ = emit(args[0])
+            return f"{name}({sql})", kind, PREC_ATOM
+        if len(args) == 2:
+            emitted = [emit(arg) for arg in args]
+            function = 'LEAST' if name == 'MIN' else 'GREATEST'
+            return f"{function}({emitted[0][0]}, {emitted[1][0]})", emitted[0][1], PREC_ATOM
+        raise UnsupportedFormula(f"{name} takes one or two arguments")
+
+    if name in SIMPLE_FUNCTIONS:
+        function, counts, kind = SIMPLE_FUNCTIONS[name]
+        if len(args) not in counts:
+            raise UnsupportedFormula(f"Unexpected argument count for {name}")
+        return f"{function}({', '.join(emit(arg)[0] for arg in args)})", kind, PREC_ATOM
+
+    emitted = [emit(arg) for arg in args]
+    sql = [item[0] for item in emitted]
+    if name == 'COUNTD' and len(args) == 1:
+        return f"COUNT(DISTINCT {sql[0]})", 'number', PREC_ATOM
+    if name == 'ZN' and len(args) == 1:
+        return f"IFNULL({sql[0]}, 0)", 'number', PREC_ATOM
+    if name == 'IFNULL' and len(args) == 2:
+        return f"IFNULL({sql[0]}, {sql[1]})", emitted[0][1] or emitted[1][1], PREC_ATOM
+    if name == 'ISNULL' and len(args) == 1:
+        return f"{wrap(emitted[0], PREC_COMPARE + 1)} IS NULL", 'boolean', PREC_COMPARE
+    if name == 'IIF' and len(args) == 3:
+        return f"CASE WHEN {sql[0]} THEN {sql[1]} ELSE {sql[2]} END", emitted[1][1] or emitted[2][1], PREC_ATOM
+    if name == 'CONTAINS' and len(args) == 2:
+        return f"INSTR({sql[0]}, {sql[1]}) > 0", 'boolean', PREC_COMPARE
+    if name == 'STARTSWITH' and len(args) == 2:
+        return f"INSTR({sql[0]}, {sql[1]}) = 1", 'boolean', PREC_COMPARE
+    if name == 'ENDSWITH' and len(args) == 2:
+        return f"RIGHT({sql[0]}, CHAR_LENGTH({sql[1]})) = {sql[1]}", 'boolean', PREC_COMPARE
+    if name in ('DATEPART', 'DATETRUNC') and len(args) == 2:
+        if args[0][0] != 'string':
+            raise UnsupportedFormula(f"{name} needs a literal date part")
+        part = args[0][1].lower()
+        if name == 'DATEPART' and part in DATEPART_FUNCTIONS:
+            return f"{DATEPART_FUNCTIONS[part]}({sql[1]})", 'number', PREC_ATOM
+        if name == 'DATETRUNC' and part in DATETRUNC_TEMPLATES:
+            return DATETRUNC_TEMPLATES[part].format(sql[1]), 'date', PREC_ATOM
+        raise UnsupportedFormula(f"Unsupported date part {part!r}")
+
+    raise UnsupportedFormula(f"Unsupported function {name}")
+
+
+def emit(node):
+    # Returns (sql, type, precedence); type is 'number', 'string', 'boolean',
+    # 'date' or None when it cannot be inferred (e.g. a bare field).
+    kind = node[0]
+    if kind == 'number':
+        return node[1], 'number', PREC_ATOM
+    if kind == 'string':
+        return emit_string(node[1]), 'string', PREC_ATOM
+    if kind == 'boolean':
+        return node[1], 'boolean', PREC_ATOM
+    if kind == 'null':
+        return 'NULL', None, PREC_ATOM
+    if kind == 'field':
+        return emit_field(node[1]), None, PREC_ATOM
+    if kind == 'call':
+        return emit_call(node[1], node[2])
+    if kind == 'negate':
+        return f"-{wrap(emit(node[1]), PREC_NEG)}", 'number', PREC_NEG
+    if kind == 'not':
+        return f"NOT {wrap(emit(node[1]), PREC_NEG)}", 'boolean', PREC_NOT
+    if kind == 'in':
+        items = ', '.join(emit(item)[0] for item in node[2])
+        return f"{wrap(emit(node[1]), PREC_COMPARE + 1)} IN ({items})", 'boolean', PREC_COMPARE
+    if kind == 'if':
+        parts = ['CASE']
+        branch_type = None
+        for condition, value in node[1]:
+            emitted = emit(value)
+            branch_type = branch_type or emitted[1]
+            parts.append(f"WHEN {emit(condition)[0]} THEN {emitted[0]}")
+        if node[2] is not None:
+            emitted = emit(node[2])
+            branch_type = branch_type or emitted[1]
+            parts.append(f"ELSE {emitted[0]}")
+        parts.append('END')
+        return ' '.join(parts), branch_type, PREC_ATOM
+    if kind == 'case':
+        parts = ['CASE', emit(node[1])[0]]
+        branch_type = None
+        for match, value in node[2]:
+            emitted = emit(value)
+            branch_type = branch_type or emitted[1]
+            parts.append(f"WHEN {emit(match)[0]} THEN {emitted[0]}")
+        if node[3] is not None:
+            emitted = emit(node[3])
+            branch_type = branch_type or emitted[1]
+            parts.append(f"ELSE {emitted[0]}")
+        parts.append('END')
+        return ' '.join(parts), branch_type, PREC_ATOM
+
+    op, left, right = node[1], emit(node[2]), emit(node[3])
+    if op == '+' and 'string' in (left[1], right[1]):
+        return f"CONCAT({left[0]}, {right[0]})", 'string', PREC_ATOM
+    if op in ('OR', 'AND'):
+        precedence = PREC_OR if op == 'OR' else PREC_AND
+        return f"{wrap(left, precedence)} {op} {wrap(right, precedence)}", 'boolean', precedence
+    if op in ('+', '-'):
+        # Tableau's + also concatenates strings and shifts dates, and a bare
+        # field's type is unknown here, so arithmetic is only emitted when
+        # both sides are known to be numbers.
+        if left[1] != 'number' or right[1] != 'number':
+            raise UnsupportedFormula(f"Operand types of {op} are unknown")
+        return f"{wrap(left, PREC_ADD)} {op} {wrap(right, PREC_ADD + 1)}", 'number', PREC_ADD
+    if op in ('*', '/', '%'):
+        return f"{wrap(left, PREC_MUL)} {op} {wrap(right, PREC_MUL + 1)}", 'number', PREC_MUL
+    return f"{wrap(left, PREC_COMPARE + 1)} {op} {wrap(right, PREC_COMPARE + 1)}", 'boolean', PREC_COMPARE
+
+
+def transpile(formula):
+    if not formula or not formula.strip():
+        raise UnsupportedFormula("Empty formula")
+    return emit(Parser(tokenize(formula)).parse())[0]
@@ -0,0 +1,231 @@
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobStore:
+    # Job state lives in SQLite so queued work survives a restart and can be
+    # shared by several processes. A running job holds a lease that its
+    # worker renews; a job whose lease expires (the worker died) is handed
+    # to the next worker, up to max_attempts times.
+    def __init__(self, path, lease_seconds=300, max_attempts=3, retention_seconds=24 * 3600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, status TEXT NOT NULL, '
+            'stage TEXT, done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0, '
+            'result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, '
+            'created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL, finished_at REAL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs (status, created_at)')
+        self._conn.commit()
+
+    def create(self, kind, params):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, kind, params, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(params), QUEUED, now, now)
+            )
+            self._conn.commit()
+        return job_id
+
+    def claim(self):
+        # Returns (id, kind, params) of the oldest runnable job, now marked
+        # running, or None. BEGIN IMMEDIATE takes the database write lock so
+        # two processes never claim the same job.
+        now = time.time()
+        expired = now - self.lease_seconds
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = 'Worker stopped while running the job', finished_at = ? "
+                    'WHERE status = ? AND updated_at < ? AND attempts >= ?',
+                    (FAILED, now, RUNNING, expired, self.max_attempts)
+                )
+                row = self._conn.execute(
+                    'SELECT id, kind, params FROM jobs WHERE status = ? OR (status = ? AND updated_at < ?) '
+                    'ORDER BY created_at LIMIT 1', (QUEUED, RUNNING, expired)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        'UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, updated_at = ? '
+                        'WHERE id = ?', (RUNNING, now, now, row[0])
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def progress(self, job_id, stage=None, done=None, total=None):
+        # Also renews the job's lease.
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET stage = COALESCE(?, stage), done = COALESCE(?, done), '
+                'total = COALESCE(?, total), updated_at = ? WHERE id = ?',
+                (stage, done, total, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?',
+                [(time.time(), job_id, RUNNING) for job_id in job_ids]
+            )
+            self._conn.commit()
+
+    def finish(self, job_id, result):
+        self._complete(job_id, DONE, json.dumps(result), None)
+
+    def fail(self, job_id, error):
+        self._complete(job_id, FAILED, None, error)
+
+    def _complete(self, job_id, status, result, error):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, finished_at = ? WHERE id = ?',
+                (status, result, error, now, now, job_id)
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, kind, status, stage, done, total, error, attempts, created_at, started_at, finished_at '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ('id', 'kind', 'status', 'stage', 'done', 'total', 'error', 'attempts',
+                'created_at', 'started_at', 'finished_at')
+        return dict(zip(keys, row))
+
+    def result(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def queued(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)).fetchone()[0]
+
+    def purge(self):
+        # Drops finished jobs past their retention and returns their params
+        # so the caller can clean up any files they refer to.
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT params FROM jobs WHERE status IN (?, ?) AND finished_at < ?', (DONE, FAILED, cutoff)
+            ).fetchall()
+            self._conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?', (DONE, FAILED, cutoff)
+            )
+            self._conn.commit()
+        return [json.loads(row[0]) for row in rows]
+
+
+class JobRunner:
+    # A fixed pool of threads draining the store. handlers maps a job kind to
+    # fn(params, report) returning a JSON-serialisable result, where
+    # report(stage=None, done=None, total=None) records progress. cleanup,
+    # if given, is called with the params of every job dropped by purge().
+    def __init__(self, store, handlers, workers=2, poll_seconds=1.0, purge_seconds=600, cleanup=None):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.purge_seconds = purge_seconds
+        self.cleanup = cleanup
+        self._last_purge = 0.0
+        self._wakeup = threading.Event()
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _work(self):
+        while True:
+            try:
+                job = self.store.claim()
+            except sqlite3.Error as e:
+                print(f"Claiming a job failed: {e}")
+                job = None
+            if job is None:
+                self._purge()
+                # Jobs enqueued by other processes are picked up on the next
+                # poll; ones enqueued here wake a worker immediately.
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+                continue
+            self._run(*job)
+
+    def _run(self, job_id, kind, params):
+        with self._running_lock:
+            self._running.add(job_id)
+        try:
+            report = lambda stage=None, done=None, total=None: self.store.progress(job_id, stage, done, total)
+            result = self.handlers[kind](params, report)
+        except Exception as e:
+            traceback.print_exc()
+            self.store.fail(job_id, str(e) or type(e).__name__)
+        else:
+            self.store.finish(job_id, result)
+        finally:
+            with self._running_lock:
+                self._running.discard(job_id)
+
+    def _purge(self):
+        now = time.monotonic()
+        with self._running_lock:
+            if now - self._last_purge < self.purge_seconds:
+                return
+            self._last_purge = now
+        for params in self.store.purge():
+            if self.cleanup is not None:
+                self.cleanup(params)
+
+    def _heartbeat(self):
+        # Keeps leases alive for jobs in a long step that reports no progress.
+        while True:
+            time.sleep(self.store.lease_seconds / 3)
+            with self._running_lock:
+                running = list(self._running)
+            try:
+                self.store.heartbeat(running)
+            except sqlite3.Error as e:
+                print(f"Job heartbeat failed: {e}")
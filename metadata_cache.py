@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Bump when the shape of the extracted metadata changes so that entries
+# written by an older extractor are never served.
+CACHE_VERSION = '5'
+
+CHUNK_SIZE = 1024 * 1024
+
+# Keys are content_hash digests. Anything else, such as an extraction id
+# taken from a request, is never looked up, so it can never become part of
+# a file path.
+CACHE_KEY = re.compile(r'[0-9a-f]{64}')
+
+
+def is_cache_key(key):
+    return isinstance(key, str) and CACHE_KEY.fullmatch(key) is not None
+
+
+def content_hash(fileobj):
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MetadataCache:
+    # The memory tier is bounded by entry count and by the total size of the
+    # payloads it holds; a payload larger than memory_max_bytes on its own is
+    # only kept on disk.
+    def __init__(self, max_entries=128, disk_dir=None, disk_max_bytes=512 * 1024 * 1024,
+                 memory_max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        if not is_cache_key(key):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(payload)
+
+        payload = self._read_disk(key)
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, payload)
+        return json.loads(payload)
+
+    def put(self, key, metadata):
+        if not is_cache_key(key):
+            raise ValueError(f"Invalid metadata cache key: {key!r}")
+        payload = json.dumps(metadata)
+        with self._lock:
+            self._remember(key, payload)
+        self._write_disk(key, payload)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'memory_bytes': self._memory_bytes,
+                'memory_max_bytes': self.memory_max_bytes,
+                'disk_dir': self.disk_dir,
+            }
+
+    def _remember(self, key, payload):
+        # Payloads are ASCII (json.dumps escapes everything else), so their
+        # length is their size in bytes.
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        if len(payload) > self.memory_max_bytes:
+            return
+        self._entries[key] = payload
+        self._memory_bytes += len(payload)
+        while len(self._entries) > self.max_entries or self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _path(self, key):
+        if not is_cache_key(key):
+            raise ValueError(f"Invalid metadata cache key: {key!r}")
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = f.read()
+            # Reads refresh the mtime so eviction drops the least recently used.
+            os.utime(path)
+        except OSError:
+            return None
+        return payload
+
+    def _write_disk(self, key, payload):
+        if not self.disk_dir:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(key))
+            self._evict_disk()
+        except OSError as e:
+            print(f"Error writing metadata cache entry: {e}")
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,144 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from conversion_batches import BATCH_INSTRUCTIONS
+
+# A local stand-in for the OpenAI chat completions API, for benchmarks and
+# offline runs. Point the app at it with
+#   python mock_openai.py --port 8001 --latency 0.3 --error-rate 0.05
+#   OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPEN_AI_API_KEY=mock python app2.py
+# Replies echo each formula back as its "conversion", so placeholders in
+# templated formulas survive the round trip.
+
+
+class MockSettings:
+    # latency and jitter are in seconds; each request sleeps latency plus a
+    # uniform share of jitter. error_rate answers with a 500 and
+    # rate_limit_rate with a 429 carrying retry_after; drop_rate leaves an
+    # entry out of a batched reply so the caller has to retry it.
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=0.0, drop_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'batch_requests': 0, 'errors': 0, 'rate_limited': 0, 'dropped': 0}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        settings = self.server.settings
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._reply(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+
+        settings.count('requests')
+        time.sleep(settings.latency + settings.jitter * settings.roll())
+
+        roll = settings.roll()
+        if roll < settings.error_rate:
+            settings.count('errors')
+            return self._reply(500, {'error': {'message': 'Mock server error', 'type': 'server_error'}})
+        if roll < settings.error_rate + settings.rate_limit_rate:
+            settings.count('rate_limited')
+            return self._reply(429, {'error': {'message': 'Mock rate limit', 'type': 'rate_limit_error'}},
+                               {'Retry-After': str(settings.retry_after)})
+
+        prompt = body['messages'][-1]['content']
+        if body.get('response_format'):
+            settings.count('batch_requests')
+            content = json.dumps({'results': self._convert_batch(settings, prompt)})
+        else:
+            content = 'BEAST(' + prompt.split('format: ', 1)[-1].rsplit('. Return only', 1)[0] + ')'
+
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        self._reply(200, {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    def _convert_batch(self, settings, prompt):
+        results = []
+        for item in json.loads(prompt[len(BATCH_INSTRUCTIONS):]):
+            if settings.roll() < settings.drop_rate:
+                settings.count('dropped')
+                continue
+            results.append({'id': item['id'], 'beast_mode': 'BEAST(' + item['formula'] + ')'})
+        return results
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server(settings=None, host='127.0.0.1', port=0):
+    # Serves on a background thread; port 0 picks a free port. Returns the
+    # server, whose base_url attribute is what OPENAI_BASE_URL should be.
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.settings = settings or MockSettings()
+    server.base_url = f'http://{host}:{server.server_address[1]}/v1'
+    threading.Thread(target=server.serve_forever, name='mock-openai', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a mock OpenAI-compatible chat completions API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds, uniformly')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of requests answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=0.0, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='share of batch entries left out of replies')
+    parser.add_argument('--seed', type=int, default=0)
+    args = vars(parser.parse_args(argv))
+    host, port = args.pop('host'), args.pop('port')
+    server = start_server(MockSettings(**args), host, port)
+    print(f"Mock OpenAI API at {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
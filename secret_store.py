@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+
+# Secrets are a flat JSON object such as
+#   {"OPEN_AI_API_KEY": "...", "APP_SECRET_KEY": "...", "LANGCHAIN_API_KEY": "..."}
+# fetched from Secret Manager in production, or from a local file or the
+# environment for offline runs.
+
+SECRET_NAMES = ('OPEN_AI_API_KEY', 'APP_SECRET_KEY', 'LANGCHAIN_API_KEY')
+
+
+class SecretManagerProvider:
+    def __init__(self, secret_name):
+        self.secret_name = secret_name
+
+    def fetch(self):
+        # Imported here: the SDK is slow to import and only needed once the
+        # first secret is actually read.
+        from google.cloud import secretmanager
+
+        client = secretmanager.SecretManagerServiceClient()
+        response = client.access_secret_version(request={"name": self.secret_name})
+        return json.loads(response.payload.data.decode("UTF-8"))
+
+
+class FileProvider:
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self):
+        with open(self.path, encoding='utf-8') as f:
+            return json.load(f)
+
+
+class EnvProvider:
+    def fetch(self):
+        return {name: os.environ[name] for name in SECRET_NAMES if name in os.environ}
+
+
+def provider_from_env(secret_name):
+    # SECRETS_PROVIDER picks one explicitly. Otherwise a SECRETS_FILE, then
+    # an OPEN_AI_API_KEY in the environment, take precedence over Secret
+    # Manager.
+    kind = os.getenv('SECRETS_PROVIDER')
+    if kind is None:
+        if os.getenv('SECRETS_FILE'):
+            kind = 'file'
+        elif os.getenv('OPEN_AI_API_KEY'):
+            kind = 'env'
+        else:
+            kind = 'secretmanager'
+    if kind == 'file':
+        return FileProvider(os.environ['SECRETS_FILE'])
+    if kind == 'env':
+        return EnvProvider()
+    if kind == 'secretmanager':
+        return SecretManagerProvider(secret_name)
+    raise ValueError(f"Unknown SECRETS_PROVIDER: {kind}")
+
+
+class CachedSecrets:
+    # Fetches on first use; concurrent first callers wait for the same
+    # fetch. Once the values are older than ttl_seconds they are refreshed
+    # on a background thread while callers keep getting the cached copy. A
+    # failed refresh is retried after retry_seconds.
+    def __init__(self, provider, ttl_seconds=3600, retry_seconds=60):
+        self.provider = provider
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.refreshes = 0
+        self._values = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self, name, default=None):
+        return self.values().get(name, default)
+
+    def values(self):
+        with self._lock:
+            if self._values is None:
+                self._values = self.provider.fetch()
+                self._loaded_at = time.monotonic()
+            elif time.monotonic() - self._loaded_at > self.ttl_seconds and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, name='secret-refresh', daemon=True).start()
+            return self._values
+
+    def loaded(self):
+        return self._values is not None
+
+    def prefetch(self):
+        # Starts the first fetch in the background so it overlaps with
+        # startup instead of delaying the first request that needs it.
+        def load():
+            try:
+                self.values()
+            except Exception as e:
+                print(f"Prefetching secrets failed: {e}")
+
+        threading.Thread(target=load, name='secret-prefetch', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            values = self.provider.fetch()
+        except Exception as e:
+            print(f"Refreshing secrets failed: {e}")
+            with self._lock:
+                self._loaded_at = time.monotonic() - self.ttl_seconds + self.retry_seconds
+        else:
+            with self._lock:
+                self._values = values
+                self._loaded_at = time.monotonic()
+                self.refreshes += 1
+        finally:
+            with self._lock:
+                self._refreshing = False
@@ -0,0 +1,89 @@
+import json
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Per-upload state kept on the server and referenced from the client by a
+# short random token, instead of being stuffed into the session cookie.
+# Payloads are stored as zlib-compressed JSON.
+
+
+class SessionStore:
+    # An in-process LRU with TTL expiry. When path is set, entries are also
+    # written to SQLite so they survive a restart and can be shared by
+    # processes on the same host.
+    def __init__(self, max_entries=256, ttl_seconds=6 * 3600, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'token TEXT PRIMARY KEY, payload BLOB NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)')
+            self._conn.commit()
+
+    def put(self, value):
+        token = secrets.token_urlsafe(16)
+        payload = zlib.compress(json.dumps(value).encode('utf-8'))
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(token, payload, expires_at)
+            if self._conn is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO sessions (token, payload, expires_at) VALUES (?, ?, ?)',
+                    (token, payload, expires_at)
+                )
+                self._conn.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
+                self._conn.commit()
+        return token
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] < now:
+                del self._entries[token]
+                entry = None
+            if entry is None and self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT expires_at, payload FROM sessions WHERE token = ? AND expires_at >= ?', (token, now)
+                ).fetchone()
+                if row is not None:
+                    entry = row
+                    self._remember(token, row[1], row[0])
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            payload = entry[1]
+        return json.loads(zlib.decompress(payload))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'compressed_bytes': sum(len(payload) for _, payload in self._entries.values()),
+            }
+
+    def _remember(self, token, payload, expires_at):
+        self._entries[token] = (expires_at, payload)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
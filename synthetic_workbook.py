@@ -0,0 +1,160 @@
+import argparse
+import io
+import random
+import sys
+import zipfile
+from xml.sax.saxutils import quoteattr
+
+# Generates synthetic Tableau workbooks for benchmarking. Every count is
+# per workbook except records, calculations and join_tables, which are per
+# datasource:
+#   python synthetic_workbook.py out.twb --datasources 4 --records 20000
+#   python synthetic_workbook.py out.twbx --calculations 500 --calc-depth 8
+# The output is deterministic for a given seed.
+
+DEFAULT_SHAPE = {
+    'datasources': 3,
+    'records': 200,
+    'calculations': 30,
+    'calc_depth': 4,
+    'join_tables': 3,
+    'worksheets': 10,
+    'dashboards': 3,
+    'zones': 6,
+}
+
+LOCAL_TYPES = ('integer', 'real', 'string', 'date', 'boolean')
+
+# Calculations alternate between formulas the rule-based transpiler handles
+# and ones it sends to the model, so conversion benchmarks exercise both.
+# {ref} is the calculation this one depends on, {n} keeps formulas distinct.
+FORMULAS = (
+    'SUM([Sales]) + {ref} * {n}',
+    '{{FIXED [Region] : SUM({ref})}} / {n}',
+    'IF {ref} > {n} THEN "High" ELSE "Low" END',
+    'WINDOW_SUM(SUM({ref})) - {n}',
+    'DATEDIFF(\'day\', [Order Date], [Ship Date]) + {n}',
+    'RUNNING_AVG(SUM({ref})) * {n}',
+)
+
+
+def generate_twb(seed=0, **shape):
+    # Returns the workbook XML as a string.
+    shape = dict(DEFAULT_SHAPE, **shape)
+    rng = random.Random(seed)
+    parts = ['<?xml version="1.0" encoding="utf-8"?>',
+             "<workbook original-version='18.1' source-build='2023.1.0' version='18.1'>",
+             "<preferences><preference name='ui.encoding.shelf.height' value='24' /></preferences>",
+             "<style><style-rule element='all'><format attr='font-family' value='Tableau Book' /></style-rule></style>",
+             '<datasources>']
+    for number in range(shape['datasources']):
+        parts.extend(_datasource(rng, number, shape, seed))
+    parts.append('</datasources><worksheets>')
+    for number in range(shape['worksheets']):
+        parts.append(
+            f"<worksheet name='Sheet {number}'><table><view><datasources>"
+            f"<datasource name='ds{number % max(shape['datasources'], 1)}' /></datasources></view>"
+            "<style><style-rule element='cell'><format attr='width' value='80' /></style-rule></style>"
+            f"<panes><pane><mark class={quoteattr(rng.choice(('Bar', 'Line', 'Circle', 'Automatic')))} /></pane></panes>"
+            '</table></worksheet>'
+        )
+    parts.append('</worksheets><dashboards>')
+    for number in range(shape['dashboards']):
+        parts.append(f"<dashboard name='Dashboard {number}'><zones>")
+        for zone in range(shape['zones']):
+            sheet = rng.randrange(max(shape['worksheets'], 1))
+            parts.append(
+                f"<zone id='{zone + 1}' name='Sheet {sheet}'>"
+                f"<formatted-text><run>Sheet {sheet}</run></formatted-text></zone>"
+            )
+        parts.append('</zones></dashboard>')
+    parts.append('</dashboards><windows>')
+    for number in range(shape['worksheets']):
+        parts.append(f"<window class='worksheet' name='Sheet {number}'><cards><edge name='left' /></cards></window>")
+    parts.append("</windows><thumbnails><thumbnail name='Sheet 0'>" + 'iVBORw0KGgo' * 200 + '</thumbnail></thumbnails>')
+    parts.append('</workbook>')
+    return '\n'.join(parts)
+
+
+def _datasource(rng, number, shape, seed):
+    tables = [f'T{number}_{table}' for table in range(max(shape['join_tables'], 1))]
+    yield f"<datasource caption='Datasource {number}' inline='true' name='ds{number}' version='18.1'>"
+    yield "<connection class='federated'><named-connections>"
+    yield (f"<named-connection caption='server{number}' name='sqlserver.{number}'>"
+           f"<connection class='sqlserver' dbname='db{number}' server='server{number}.example.com' />"
+           '</named-connection></named-connections>')
+    yield from _join_tree(tables, f'sqlserver.{number}')
+    yield '<metadata-records>'
+    for record in range(shape['records']):
+        yield (f"<metadata-record class='column'><remote-name>col{record}</remote-name>"
+               f"<remote-type>3</remote-type><local-name>[col{record}]</local-name>"
+               f"<parent-name>[{tables[record % len(tables)]}]</parent-name>"
+               f"<local-type>{LOCAL_TYPES[record % len(LOCAL_TYPES)]}</local-type>"
+               '<contains-null>true</contains-null></metadata-record>')
+    yield '</metadata-records></connection>'
+    for column in range(5):
+        yield f"<column datatype='string' name='[col{column}]' role='dimension' type='nominal' />"
+    # Calculations form chains calc_depth long: each one refers to the
+    # previous calculation in its chain, the first to a plain column.
+    depth = max(shape['calc_depth'], 1)
+    for calc in range(shape['calculations']):
+        ref = f'[Calculation_{number}_{calc - 1}]' if calc % depth else f'[col{calc % 5}]'
+        formula = FORMULAS[calc % len(FORMULAS)].format(ref=ref, n=seed * 100000 + number * 1000 + calc)
+        yield (f"<column caption='Calc {number}-{calc}' datatype='real' name='[Calculation_{number}_{calc}]' role='measure'>"
+               f"<calculation class='tableau' formula={quoteattr(formula)} /></column>")
+    if number == 0:
+        yield "<column caption='Parameter 1' datatype='string' name='[Parameter 1]' param-domain-type='list' role='measure'>"
+        yield "<calculation class='tableau' formula='&quot;East&quot;' /></column>"
+    if number == 0 and len(tables) >= 2:
+        yield ("<object-graph><relationships><relationship><expression op='='>"
+               f"<expression op='[{tables[0]}].[id]' /><expression op='[{tables[1]}].[id]' /></expression>"
+               f"<first-end-point object-id='{tables[0]}' /><second-end-point object-id='{tables[1]}' />"
+               '</relationship></relationships></object-graph>')
+    yield '</datasource>'
+
+
+def _join_tree(tables, connection):
+    # A left-deep tree: ((T0 JOIN T1) JOIN T2) ...
+    if len(tables) == 1:
+        yield f"<relation connection='{connection}' name='{tables[0]}' table='[dbo].[{tables[0]}]' type='table' />"
+        return
+    for position in range(len(tables) - 1, 0, -1):
+        join = ('inner', 'left', 'right')[position % 3]
+        yield (f"<relation join='{join}' type='join'><clause type='join'><expression op='='>"
+               f"<expression op='[{tables[position - 1]}].[id]' /><expression op='[{tables[position]}].[id]' />"
+               '</expression></clause>')
+    yield f"<relation connection='{connection}' name='{tables[0]}' table='[dbo].[{tables[0]}]' type='table' />"
+    for position in range(1, len(tables)):
+        yield f"<relation connection='{connection}' name='{tables[position]}' table='[dbo].[{tables[position]}]' type='table' />"
+        yield '</relation>'
+
+
+def write_workbook(path, seed=0, **shape):
+    # Writes a .twb, or a .twbx holding the workbook plus a dummy extract.
+    xml = generate_twb(seed, **shape)
+    if path.lower().endswith('.twbx'):
+        name = path.replace('\\', '/').rsplit('/', 1)[-1][:-1]
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr(name, xml)
+            z.writestr('Data/Extracts/extract.hyper', random.Random(seed).randbytes(64 * 1024))
+    else:
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(xml)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic Tableau workbook (.twb or .twbx).')
+    parser.add_argument('path', help='output file; a .twbx extension writes a packaged workbook')
+    parser.add_argument('--seed', type=int, default=0)
+    for name, default in DEFAULT_SHAPE.items():
+        parser.add_argument('--' + name.replace('_', '-'), type=int, default=default)
+    args = vars(parser.parse_args(argv))
+    path = args.pop('path')
+    write_workbook(path, **args)
+    print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+from formula_templates import restore, templatize
+
+STRINGS = {'[First Name]': 'string', '[Last Name]': 'string'}
+NUMBERS = {'[Sales]': 'real', '[Profit]': 'real', '[Cost]': 'real'}
+DATES = {'[Order Date]': 'date'}
+
+
+def test_same_shape_and_types_share_a_template():
+    assert templatize('[Sales] + [Profit]', NUMBERS)[0] == templatize('[Cost]  +  [Sales]', NUMBERS)[0]
+
+
+def test_field_types_are_part_of_the_template():
+    assert templatize('[First Name] + [Last Name]', STRINGS)[0] != templatize('[Sales] + [Profit]', NUMBERS)[0]
+    assert templatize('[Order Date] + 7', DATES)[0] != templatize('[Sales] + 7', NUMBERS)[0]
+
+
+def test_unknown_field_type_keeps_the_whole_formula():
+    assert templatize('[Sales] + [Region]', NUMBERS) == ('[Sales] + [Region]', [])
+    assert templatize('[Sales] + [Profit]') == ('[Sales] + [Profit]', [])
+
+
+def test_references_in_strings_and_comments_are_not_fields():
+    template, fields = templatize('[Sales] + 1 // not [Profit]\n', NUMBERS)
+    assert fields == ['[Sales]']
+    assert template == '[Field_1] + 1 // not [Profit]\n// Field types: [Field_1] real'
+
+
+def test_restore():
+    template, fields = templatize('[First Name] + [Last Name]', STRINGS)
+    assert restore('CONCAT(`Field_1`, [Field_2])', fields) == 'CONCAT(`First Name`, [Last Name])'
+    assert restore('CONCAT(`Field_1`, `Field_3`)', fields) is None
@@ -0,0 +1,56 @@
+import pytest
+
+from formula_transpiler import UnsupportedFormula, transpile
+
+# Tableau formula -> expected Beast Mode.
+CONVERTED = [
+    ('SUM([Sales]) + SUM([Profit])', 'SUM(`Sales`) + SUM(`Profit`)'),
+    ('SUM([Sales]) - 1', 'SUM(`Sales`) - 1'),
+    ('-SUM([Sales]) + 5', '-SUM(`Sales`) + 5'),
+    ('(1 + 2) * 3', '(1 + 2) * 3'),
+    ('SUM([Sales]) / SUM([Profit])', 'SUM(`Sales`) / SUM(`Profit`)'),
+    ('"Hello " + [Name]', "CONCAT('Hello ', `Name`)"),
+    ('[Name] + "!"', "CONCAT(`Name`, '!')"),
+    ('UPPER([First]) + LOWER([Last])', 'CONCAT(UPPER(`First`), LOWER(`Last`))'),
+    ("'a''b' + [x]", "CONCAT('a''b', `x`)"),
+    ('LEN([Name])', 'CHAR_LENGTH(`Name`)'),
+    ('ENDSWITH([Name], "x")', "RIGHT(`Name`, CHAR_LENGTH('x')) = 'x'"),
+    ('CONTAINS([Name], "Inc")', "INSTR(`Name`, 'Inc') > 0"),
+    ('MID([a], 2, 3)', 'SUBSTRING(`a`, 2, 3)'),
+    ('IF [a] > 3 THEN "x" ELSE "y" END', "CASE WHEN `a` > 3 THEN 'x' ELSE 'y' END"),
+    ('IIF([a] = 1, "y", "n")', "CASE WHEN `a` = 1 THEN 'y' ELSE 'n' END"),
+    ('CASE [Region] WHEN "East" THEN 1 ELSE 0 END', "CASE `Region` WHEN 'East' THEN 1 ELSE 0 END"),
+    ('COUNTD([Customer])', 'COUNT(DISTINCT `Customer`)'),
+    ('ZN(SUM([Sales]))', 'IFNULL(SUM(`Sales`), 0)'),
+    ('ISNULL([a])', '`a` IS NULL'),
+    ('[a] AND NOT [b]', '`a` AND NOT `b`'),
+    ('[Region] IN ("East", "West")', "`Region` IN ('East', 'West')"),
+    ('MIN([a], [b])', 'LEAST(`a`, `b`)'),
+    ("DATEPART('year', [Order Date])", 'YEAR(`Order Date`)'),
+    ("DATETRUNC('month', [Order Date])", "DATE(DATE_FORMAT(`Order Date`, '%Y-%m-01'))"),
+]
+
+# Formulas that must be left to the model.
+UNSUPPORTED = [
+    '[First Name] + [Last Name]',
+    '[Date] + 1',
+    '[Sales] - [Cost]',
+    '"a" - [x]',
+    '{FIXED [Region] : SUM([Sales])}',
+    'WINDOW_SUM(SUM([a]))',
+    '[Parameters].[Rate] * 2',
+    '[Calculation_123] * 2',
+    "DATEPART('week', [Order Date])",
+    '',
+]
+
+
+@pytest.mark.parametrize('formula, expected', CONVERTED)
+def test_converted(formula, expected):
+    assert transpile(formula) == expected
+
+
+@pytest.mark.parametrize('formula', UNSUPPORTED)
+def test_unsupported(formula):
+    with pytest.raises(UnsupportedFormula):
+        transpile(formula)
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import xml_backend
+from synthetic_workbook import generate_twb
+from twb_extract import extract_twb_metadata, stream_twb_metadata
+
+
+def workbook(datasource):
+    return ('<?xml version="1.0" encoding="utf-8"?><workbook version="18.1"><datasources>'
+            f'{datasource}</datasources><worksheets /><dashboards /></workbook>')
+
+
+# Records where a field is missing or has no text, so _container_records
+# falls back to reading them one at a time.
+PARTIAL_RECORDS = workbook(
+    "<datasource caption='Partial' name='ds0'><connection class='sqlserver'>"
+    "<relation connection='c' name='T' table='[dbo].[T]' type='table' />"
+    '<metadata-records>'
+    "<metadata-record class='column'><remote-name>a</remote-name><parent-name>[T]</parent-name>"
+    '<local-type>integer</local-type></metadata-record>'
+    "<metadata-record class='column'><remote-name>b</remote-name><local-type>string</local-type></metadata-record>"
+    "<metadata-record class='column'><remote-name></remote-name><parent-name>[T]</parent-name>"
+    '<local-type>real</local-type></metadata-record>'
+    "<metadata-record class='column'><remote-name>d</remote-name><parent-name>[T]</parent-name>"
+    '<local-type /></metadata-record>'
+    "<metadata-record class='capability'><remote-name>e</remote-name></metadata-record>"
+    '</metadata-records></connection></datasource>'
+)
+
+# Named connections inside a federated connection, plus one inside the
+# datasource's extract, which is not a connection of the datasource.
+NAMED_CONNECTIONS = workbook(
+    "<datasource caption='Federated' name='ds0'><connection class='federated'><named-connections>"
+    "<named-connection caption='one' name='sqlserver.1'>"
+    "<connection class='sqlserver' dbname='db1' server='one.example.com' /></named-connection>"
+    "<named-connection caption='two' name='postgres.2'>"
+    "<connection class='postgres' dbname='db2' server='two.example.com' /></named-connection>"
+    '</named-connections>'
+    "<relation connection='sqlserver.1' name='A' table='[dbo].[A]' type='table' /></connection>"
+    "<extract><connection class='hyper'><named-connections>"
+    "<named-connection caption='extract' name='hyper.3'><connection class='hyper' /></named-connection>"
+    '</named-connections></connection></extract></datasource>'
+)
+
+# A bushy join tree: (A JOIN B) JOIN (C JOIN (D JOIN E)).
+NESTED_JOINS = workbook(
+    "<datasource caption='Joins' name='ds0'><connection class='sqlserver'>"
+    "<relation join='inner' type='join'><clause type='join'><expression op='='>"
+    "<expression op='[A].[id]' /><expression op='[C].[id]' /></expression></clause>"
+    "<relation join='left' type='join'><clause type='join'><expression op='='>"
+    "<expression op='[A].[id]' /><expression op='[B].[id]' /></expression></clause>"
+    "<relation connection='c' name='A' table='[dbo].[A]' type='table' />"
+    "<relation connection='c' name='B' table='[dbo].[B]' type='table' /></relation>"
+    "<relation join='right' type='join'><clause type='join'><expression op='='>"
+    "<expression op='[C].[id]' /><expression op='[D].[id]' /></expression></clause>"
+    "<relation connection='c' name='C' table='[dbo].[C]' type='table' />"
+    "<relation join='inner' type='join'><clause type='join'><expression op='='>"
+    "<expression op='[D].[id]' /><expression op='[E].[id]' /></expression></clause>"
+    "<relation connection='c' name='D' table='[dbo].[D]' type='table' />"
+    "<relation connection='c' name='E' table='[dbo].[E]' type='table' /></relation></relation></relation>"
+    "<metadata-records><metadata-record class='column'><remote-name>id</remote-name>"
+    '<parent-name>[A]</parent-name><local-type>integer</local-type></metadata-record></metadata-records>'
+    '</connection></datasource>'
+)
+
+# Workbook XML and the part of the metadata it is there to exercise, which
+# must not come out empty.
+WORKBOOKS = {
+    'synthetic': (generate_twb(), 'calculations'),
+    'synthetic-single-table': (generate_twb(seed=1, join_tables=1, calc_depth=1), 'Table'),
+    'synthetic-deep': (generate_twb(seed=2, datasources=2, calculations=60, calc_depth=12, join_tables=7), 'joins'),
+    'partial-records': (PARTIAL_RECORDS, 'Table'),
+    'named-connections': (NAMED_CONNECTIONS, 'datasources'),
+    'nested-joins': (NESTED_JOINS, 'joins'),
+}
+
+
+@pytest.mark.parametrize('name', WORKBOOKS)
+def test_backends_and_modes_agree(name, tmp_path):
+    if xml_backend.lxml_etree is None:
+        pytest.skip('lxml is not installed')
+    xml, covered = WORKBOOKS[name]
+    path = tmp_path / f'{name}.twb'
+    path.write_text(xml, encoding='utf-8')
+
+    results = {}
+    for backend in ('stdlib', 'lxml'):
+        for mode, extract in (('tree', extract_twb_metadata), ('stream', stream_twb_metadata)):
+            results[backend, mode] = json.dumps(extract(str(path), backend=backend), sort_keys=True)
+    expected = results['stdlib', 'tree']
+    assert json.loads(expected)[covered]
+    for key, output in results.items():
+        assert output == expected, key
@@ -0,0 +1,605 @@
+import os
+import re
+import time
+import xml_backend
+from calc_graph import build_calculation_graph, order_calculations, resolve_calculations, resolve_formula
+from formula_templates import field_name, field_references
+from metrics import StageTimer
+from twb_index import index_dashboard, index_datasource, index_workbook, index_worksheet, record_fields
+from workbook_diff import calculation_hashes, section_hash
+
+# Sections of a workbook that never contribute to the extracted metadata.
+# In streaming mode their subtrees are discarded as soon as they close.
+SKIPPED_SECTIONS = {'thumbnails', 'windows', 'style'}
+
+# Workbooks at or above this size are parsed incrementally instead of being
+# loaded into a full ElementTree.
+STREAM_THRESHOLD_BYTES = int(os.getenv('STREAM_THRESHOLD_BYTES', 50 * 1024 * 1024))
+
+
+TABLE_NAME_BRACKETS = str.maketrans('', '', '[]')
+
+# Placeholders written when a column or record gives no type.
+UNKNOWN_TYPES = ('Unknown Datatype', 'Unknown Type', '')
+
+
+def new_metadata(title):
+    return {
+        'title': title,
+        'datasources': [],
+        'dashboards': [],
+        "worksheets":[],
+        'calculations': [],
+        'parameters': [],
+        'joins': [],
+        'join_tables': [],
+        'columns': [],
+        'Table':{},
+        'relationships': [],
+        'calculation_graph': {'dependencies': {}, 'order': [], 'cycles': [], 'unresolved': {}},
+        'hashes': {'datasources': {}, 'calculations': {}}
+    }
+
+
+def extract_connections(datasource):
+    table_columns = [col.get('name', 'Unnamed Column') for col in datasource['tables']]
+    connection_details = []
+    for connection in datasource['connections']:
+        for nc in connection['named_connections']:
+            inner_conn = nc.find('connection')
+            conn_type = conn_name = server_name = db_name = 'N/A'
+
+            if inner_conn is not None:
+                conn_type = inner_conn.get('class', 'N/A')
+                conn_name = inner_conn.get('server', 'N/A')
+                server_name = inner_conn.get('server', 'N/A')
+                db_name = inner_conn.get('dbname', 'N/A')
+
+            connection_details.append({
+                'Connection Type': conn_type,
+                'Connection Name': conn_name,
+                'Server Name': server_name,
+                'Database Name': db_name,
+                'Tables': list(table_columns)
+            })
+    return connection_details
+
+
+def add_metadata_record(table_metadata, fields):
+    # fields is a (parent-name, remote-name, local-type) tuple from
+    # twb_index.record_fields, with None for a missing child.
+    raw_table_name, column_name, col_type = fields
+    if raw_table_name is None:
+        raw_table_name = '[Unknown Table]'
+    table_name = raw_table_name.translate(TABLE_NAME_BRACKETS).strip()
+    if column_name is None:
+        column_name = 'Unknown Column'
+    if col_type is None:
+        col_type = 'Unknown Type'
+
+    if table_name not in table_metadata:
+        table_metadata[table_name] = []
+
+    table_metadata[table_name].append({"column_name" : column_name, "col_type" : col_type})
+
+
+def extract_columns(datasource):
+    columns = []
+    for column in datasource['columns']:
+        columns.append({
+            'name': column.get('name', 'Unnamed Column'),
+            'datatype': column.get('datatype', 'Unknown Datatype'),
+            'role': column.get('role', 'Unknown Role'),
+            'aggregation': column.get('aggregation', 'None'),
+        })
+    return columns
+
+
+def extract_worksheet(worksheet):
+    type_tree = worksheet['mark']
+    return {
+        'name': worksheet['element'].get('name', 'Unnamed Worksheet'),
+        'type': type_tree.get('class', 'Unknown Type') if type_tree is not None else 'Unknown Type'
+    }
+
+
+def extract_dashboard(dashboard):
+    dashboard_name = dashboard['element'].get('name', 'Unnamed Dashboard')
+    worksheet_names = []
+
+    for zone in dashboard['zones']:
+        run_element = zone['run']
+        if run_element is not None and run_element.text:
+            worksheet_names.append(run_element.text)
+
+    seen = set()
+    unique_worksheets = []
+    for ws in worksheet_names:
+        if ws not in seen:
+            seen.add(ws)
+            unique_worksheets.append(ws)
+
+    return {
+        'Dashboard Name': dashboard_name,
+        'Worksheets': unique_worksheets
+    }
+
+
+def extract_calculations(datasource):
+    calculations = []
+    for calc_field, calc_element in datasource['calculations']:
+        formula = calc_element.get('formula', 'No formula')
+        calc_name = calc_field.get('caption', calc_field.get('name', 'Unnamed Calculation'))
+        calculations.append((calc_field.get('name'), {
+            'name': calc_name,
+            'formula': formula
+        }))
+    return calculations
+
+
+def add_calculation(metadata, calculation_fields, name, calc_info):
+    if is_parameter(calc_info['formula']):
+        metadata['parameters'].append(calc_info)
+    else:
+        metadata['calculations'].append(calc_info)
+        calculation_fields.append((name, calc_info))
+
+
+def inline_calculations(calculation_fields):
+    # Replaces every reference to another calculated field by that field's
+    # fully inlined formula, resolving dependencies before dependents.
+    # References that would push a formula past MAX_INLINED_FORMULA_LENGTH
+    # stay as they are and are reported under 'unresolved'.
+    calculation_mapping = {
+        name: calc_info['formula'] for name, calc_info in calculation_fields if name is not None
+    }
+    graph = build_calculation_graph(calculation_mapping)
+    order, cycles = order_calculations(graph)
+    resolved, unresolved = resolve_calculations(calculation_mapping, graph, order)
+
+    for name, calc_info in calculation_fields:
+        if name not in resolved:
+            continue
+        if calc_info['formula'] == calculation_mapping[name]:
+            calc_info['formula'] = resolved[name]
+        else:
+            # Same internal name in another datasource; inline its own
+            # references against the resolved formulas.
+            calc_info['formula'], refs = resolve_formula(calc_info['formula'], resolved)
+            if refs:
+                unresolved.setdefault(name, refs)
+
+    return {'dependencies': graph, 'order': order, 'cycles': cycles, 'unresolved': unresolved}
+
+
+def known_field_types(columns, tables):
+    # Datatype by field name, from the <column> elements and then from the
+    # metadata records of every datasource. A name given different types in
+    # different places has no known type.
+    def collect(pairs):
+        types = {}
+        for name, datatype in pairs:
+            datatype = None if datatype in UNKNOWN_TYPES else datatype
+            types[name] = datatype if types.get(name, datatype) == datatype else None
+        return types
+
+    types = collect((record['column_name'], record['col_type'])
+                    for table_metadata in tables for records in table_metadata.values() for record in records)
+    types.update(collect((field_name(column['name']), column['datatype']) for column in columns))
+    return types
+
+
+def add_field_types(calculations, types):
+    # Records the datatype of every field a calculation's inlined formula
+    # refers to, leaving out fields whose type is unknown.
+    for calc_info in calculations:
+        field_types = {}
+        for reference in field_references(calc_info['formula']):
+            datatype = types.get(field_name(reference))
+            if datatype:
+                field_types[reference] = datatype
+        calc_info['field_types'] = field_types
+
+
+def datasource_hash(datasource, connections, table_metadata, columns, calculations, joins):
+    # Returns (key, hash) over everything extracted from one datasource.
+    # Calculations are hashed as written, before inlining.
+    element = datasource['element']
+    key = element.get('caption') or element.get('name') or 'Unnamed Datasource'
+    return key, section_hash({
+        'connections': connections,
+        'tables': table_metadata,
+        'columns': columns,
+        'calculations': [calc_info for _, calc_info in calculations],
+        'joins': joins,
+    })
+
+
+def add_datasource_hash(metadata, key, value):
+    hashes = metadata['hashes']['datasources']
+    base = key
+    count = 1
+    while key in hashes:
+        count += 1
+        key = f"{base} ({count})"
+    hashes[key] = value
+
+
+def is_parameter(formula):
+    if formula.isdigit() or formula.startswith('"') or formula.startswith('#'):
+        return True
+    return False
+
+
+# Clause operators rendered infix; anything else is rendered as a call.
+COMPARISON_OPERATORS = {'=', '<>', '!=', '<', '<=', '>', '>='}
+LOGICAL_OPERATORS = {'AND', 'OR'}
+
+# The table qualifier of a clause operand such as [Orders].[Order ID].
+QUALIFIER = re.compile(r'\[((?:[^\]]|\]\])*)\]\.\[')
+
+
+def format_expression(expression):
+    op = expression.get('op', '')
+    operands = [child for child in expression if child.tag == 'expression']
+    if not operands:
+        return op
+    upper = op.upper()
+    if upper in LOGICAL_OPERATORS:
+        return format_logical(upper, operands)
+    if op in COMPARISON_OPERATORS and len(operands) == 2:
+        return f"{format_expression(operands[0])} {op} {format_expression(operands[1])}"
+    return f"{op}({', '.join(format_expression(operand) for operand in operands)})"
+
+
+def format_logical(operator, operands):
+    parts = []
+    for operand in operands:
+        text = format_expression(operand)
+        inner = operand.get('op', '').upper()
+        if inner in LOGICAL_OPERATORS and inner != operator and len(operand):
+            text = f"({text})"
+        parts.append(text)
+    return f" {operator} ".join(parts)
+
+
+def clause_predicates(expressions):
+    # Splits AND chains, however nested, into their individual predicates.
+    predicates = []
+    for expression in expressions:
+        if expression.get('op', '').upper() == 'AND' and len(expression):
+            predicates.extend(clause_predicates([child for child in expression if child.tag == 'expression']))
+        else:
+            predicates.append(format_expression(expression))
+    return predicates
+
+
+def clause_qualifiers(expressions):
+    qualifiers = []
+    for expression in expressions:
+        for operand in expression.iter('expression'):
+            match = QUALIFIER.match(operand.get('op', ''))
+            if match and not len(operand):
+                qualifiers.append(match.group(1).replace(']]', ']'))
+    return qualifiers
+
+
+def _join_side(span, qualifiers, positions, tables, fallback):
+    # The table on one side of a join is the first table named in the ON
+    # clause that lies in that side's subtree, else the subtree's nearest
+    # table to the join.
+    for qualifier in qualifiers:
+        position = positions.get(qualifier)
+        if position is not None and span[0] <= position < span[1]:
+            return qualifier
+    return tables[fallback].get('name')
+
+
+def _walk_relation(relation, tables, positions, joins):
+    # Returns the span of the subtree's tables in 'tables'. Each subtree's
+    # tables are contiguous, so deciding which side of a join a table is on
+    # is a range check and the whole tree is walked once.
+    element = relation['element']
+    children = relation['children']
+    if not children:
+        start = len(tables)
+        tables.append(element)
+        if element.get('name') is not None:
+            positions[element.get('name')] = start
+        return start, start + 1
+
+    spans = [_walk_relation(child, tables, positions, joins) for child in children]
+    if len(spans) >= 2 and (element.get('type') == 'join' or element.get('join') is not None):
+        left_span = (spans[0][0], spans[-2][1])
+        right_span = spans[-1]
+        clause = relation['clause']
+        qualifiers = clause_qualifiers(clause)
+        predicates = clause_predicates(clause)
+        joins.append({
+            'left_table': _join_side(left_span, qualifiers, positions, tables, left_span[1] - 1),
+            'right_table': _join_side(right_span, qualifiers, positions, tables, right_span[0]),
+            'join_type': element.get('join', 'No join type'),
+            'on_clause': format_logical('AND', clause) if clause else None,
+            'predicates': predicates
+        })
+    return spans[0][0], spans[-1][1]
+
+
+def extract_join_graph(datasource):
+    # Returns (tables, joins): the nodes and edges of the datasource's join
+    # trees. The same tree may be described more than once (physical layer
+    # and object graph), so repeated tables and joins are reported once.
+    tables = []
+    joins = []
+    seen_tables = set()
+    seen_joins = set()
+    for root in datasource['relations']:
+        tree_tables = []
+        tree_joins = []
+        _walk_relation(root, tree_tables, {}, tree_joins)
+        for element in tree_tables:
+            table = {
+                'name': element.get('name', 'Unnamed Table'),
+                'table': element.get('table'),
+                'type': element.get('type', 'table')
+            }
+            key = (table['name'], table['table'])
+            if key not in seen_tables:
+                seen_tables.add(key)
+                tables.append(table)
+        for join_info in tree_joins:
+            key = (join_info['left_table'], join_info['right_table'], join_info['join_type'], join_info['on_clause'])
+            if key not in seen_joins:
+                seen_joins.add(key)
+                joins.append(join_info)
+    return tables, joins
+
+
+def extract_relationships(relationships):
+    # One pass over each relationship's children; the end points and the
+    # predicate may come in any order.
+    relationships_data = []
+    if relationships is None:
+        return relationships_data
+
+    for relation in relationships:
+        if relation.tag != 'relationship':
+            continue
+        relationship_info = {
+            'left_table': 'No left table',
+            'right_table': 'No right table',
+            'on_clause': None
+        }
+        for child in relation:
+            if child.tag == 'first-end-point':
+                relationship_info['left_table'] = child.get('object-id', 'No left table')
+            elif child.tag == 'second-end-point':
+                relationship_info['right_table'] = child.get('object-id', 'No right table')
+            elif child.tag == 'expression' and relationship_info['on_clause'] is None and len(child):
+                relationship_info['on_clause'] = format_expression(child)
+        relationships_data.append(relationship_info)
+
+    return relationships_data
+
+
+# Both extractors record the time spent in each stage on timer, a
+# metrics.StageTimer, when one is passed in.
+
+def extract_twb_metadata(file, backend=None, timer=None):
+    timer = timer or StageTimer()
+    with timer.stage('parse'):
+        root = xml_backend.parse(file, backend)
+    with timer.stage('index'):
+        index = index_workbook(root)
+
+    metadata = new_metadata(index['title'])
+    calculation_fields = []
+    tables = []
+
+    for datasource in index['datasources']:
+        with timer.stage('datasources'):
+            connections = extract_connections(datasource)
+            metadata['datasources'].extend(connections)
+
+        with timer.stage('metadata_records'):
+            table_metadata = {}
+            for record in datasource['records']:
+                add_metadata_record(table_metadata, record)
+            metadata['Table'] = table_metadata
+            tables.append(table_metadata)
+
+        with timer.stage('columns'):
+            columns = extract_columns(datasource)
+            metadata['columns'].extend(columns)
+
+        with timer.stage('calculations'):
+            calculations = extract_calculations(datasource)
+        with timer.stage('joins'):
+            join_tables, joins = extract_join_graph(datasource)
+        with timer.stage('hashes'):
+            add_datasource_hash(metadata, *datasource_hash(datasource, connections, table_metadata, columns, calculations, joins))
+
+        with timer.stage('calculations'):
+            for name, calc_info in calculations:
+                add_calculation(metadata, calculation_fields, name, calc_info)
+        metadata['joins'].extend(joins)
+        metadata['join_tables'].extend(join_tables)
+
+    with timer.stage('worksheets'):
+        for worksheet in index['worksheets']:
+            metadata['worksheets'].append(extract_worksheet(worksheet))
+
+    with timer.stage('dashboards'):
+        for dashboard in index['dashboards']:
+            metadata['dashboards'].append(extract_dashboard(dashboard))
+
+    with timer.stage('calculation_inlining'):
+        metadata['calculation_graph'] = inline_calculations(calculation_fields)
+        add_field_types(metadata['calculations'], known_field_types(metadata['columns'], tables))
+    with timer.stage('hashes'):
+        metadata['hashes']['calculations'] = calculation_hashes(metadata['calculations'])
+
+    with timer.stage('relationships'):
+        metadata['relationships'] = extract_relationships(index['relationships'])
+
+    return metadata
+
+
+def _detach(parent, elem):
+    if parent is None:
+        return
+    if len(parent) and parent[-1] is elem:
+        del parent[-1]
+    else:
+        parent.remove(elem)
+
+
+def iter_twb_records(file, backend=None, timer=None):
+    # Yields (kind, payload) pairs as the corresponding elements close.
+    # Finished subtrees are detached from their parents so that only the
+    # currently open datasource, worksheet or dashboard is held in memory.
+    timer = timer or StageTimer()
+    stack = []
+    skip_depth = 0
+    scope_depth = 0
+    table_metadata = None
+
+    for event, elem in xml_backend.iterparse(file, ('start', 'end'), backend):
+        if event == 'start':
+            stack.append(elem)
+            if len(stack) == 1:
+                yield 'title', elem.get('original-version', 'No title found')
+            if skip_depth or elem.tag in SKIPPED_SECTIONS:
+                skip_depth += 1
+            elif _is_scope(stack):
+                scope_depth += 1
+                if elem.tag == 'datasource':
+                    table_metadata = {}
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+
+        if skip_depth:
+            skip_depth -= 1
+            _detach(parent, elem)
+            continue
+
+        in_top_datasource = len(stack) >= 3 and stack[1].tag == 'datasources' and stack[2].tag == 'datasource'
+
+        if elem.tag == 'metadata-record' and parent.tag == 'metadata-records' and in_top_datasource:
+            add_metadata_record(table_metadata, record_fields(elem))
+            _detach(parent, elem)
+            continue
+
+        if _is_scope(stack + [elem]):
+            scope_depth -= 1
+            if elem.tag == 'worksheet':
+                with timer.stage('worksheets'):
+                    worksheet = extract_worksheet(index_worksheet(elem))
+                yield 'worksheet', worksheet
+            elif elem.tag == 'dashboard':
+                with timer.stage('dashboards'):
+                    dashboard = extract_dashboard(index_dashboard(elem))
+                yield 'dashboard', dashboard
+            else:
+                with timer.stage('index'):
+                    datasource = index_datasource(elem)
+                with timer.stage('datasources'):
+                    connections = extract_connections(datasource)
+                with timer.stage('columns'):
+                    columns = extract_columns(datasource)
+                with timer.stage('calculations'):
+                    calculations = extract_calculations(datasource)
+                with timer.stage('joins'):
+                    join_tables, joins = extract_join_graph(datasource)
+                with timer.stage('relationships'):
+                    relationships = None
+                    if datasource['relationships'] is not None:
+                        relationships = extract_relationships(datasource['relationships'])
+                with timer.stage('hashes'):
+                    hash_entry = datasource_hash(datasource, connections, table_metadata, columns, calculations, joins)
+                yield 'datasource_hash', hash_entry
+                for details in connections:
+                    yield 'datasource', details
+                yield 'table', table_metadata
+                for column in columns:
+                    yield 'column', column
+                for calculation in calculations:
+                    yield 'calculation', calculation
+                for join_info in joins:
+                    yield 'join', join_info
+                for table in join_tables:
+                    yield 'join_table', table
+                if relationships is not None:
+                    yield 'relationships', relationships
+                table_metadata = None
+            _detach(parent, elem)
+        elif not scope_depth:
+            _detach(parent, elem)
+
+
+def _is_scope(stack):
+    elem = stack[-1]
+    if elem.tag == 'worksheet':
+        return True
+    if len(stack) == 3 and stack[1].tag == 'datasources' and elem.tag == 'datasource':
+        return True
+    if len(stack) == 3 and stack[1].tag == 'dashboards' and elem.tag == 'dashboard':
+        return True
+    return False
+
+
+def stream_twb_metadata(file, backend=None, timer=None):
+    timer = timer or StageTimer()
+    metadata = None
+    calculation_fields = []
+    tables = []
+    relationships = None
+    start = time.perf_counter()
+    stages_before = sum(timer.seconds.values())
+
+    for kind, payload in iter_twb_records(file, backend, timer):
+        if kind == 'title':
+            metadata = new_metadata(payload)
+        elif kind == 'datasource':
+            metadata['datasources'].append(payload)
+        elif kind == 'table':
+            metadata['Table'] = payload
+            tables.append(payload)
+        elif kind == 'column':
+            metadata['columns'].append(payload)
+        elif kind == 'worksheet':
+            metadata['worksheets'].append(payload)
+        elif kind == 'dashboard':
+            metadata['dashboards'].append(payload)
+        elif kind == 'calculation':
+            add_calculation(metadata, calculation_fields, *payload)
+        elif kind == 'join':
+            metadata['joins'].append(payload)
+        elif kind == 'join_table':
+            metadata['join_tables'].append(payload)
+        elif kind == 'datasource_hash':
+            add_datasource_hash(metadata, *payload)
+        elif kind == 'relationships' and relationships is None:
+            relationships = payload
+
+    # 'stream' is whatever the streaming pass spent outside the other
+    # stages: parsing, plus reading the metadata records as they go by.
+    timer.add('stream', time.perf_counter() - start - (sum(timer.seconds.values()) - stages_before))
+
+    with timer.stage('calculation_inlining'):
+        metadata['calculation_graph'] = inline_calculations(calculation_fields)
+        add_field_types(metadata['calculations'], known_field_types(metadata['columns'], tables))
+    with timer.stage('hashes'):
+        metadata['hashes']['calculations'] = calculation_hashes(metadata['calculations'])
+    if relationships is not None:
+        metadata['relationships'] = relationships
+
+    return metadata
+
+
+def read_twb_metadata(file, stream=False, timer=None):
+    if stream:
+        return stream_twb_metadata(file, timer=timer)
+    return extract_twb_metadata(file, timer=timer)
@@ -0,0 +1,243 @@
+# Single-pass index over a parsed workbook. Every element is visited once;
+# the extractors in twb_extract.py read only from the entries built here.
+# Trees parsed by lxml are indexed with compiled XPath instead, which runs
+# the traversal in C; both paths build identical entries.
+
+from xml_backend import XPATH, is_lxml
+
+RECORD_FIELDS = {'parent-name', 'remote-name', 'local-type'}
+
+
+def iter_elements(elem, prune=()):
+    # Yields (element, ancestors) in document order. ancestors is the live
+    # list of open elements above the yielded one and must not be retained.
+    # Elements whose tag is in prune are yielded but not descended into.
+    ancestors = []
+    stack = [iter((elem,))]
+    while stack:
+        for child in stack[-1]:
+            yield child, ancestors
+            if child.tag in prune:
+                continue
+            ancestors.append(child)
+            stack.append(iter(child))
+            break
+        else:
+            stack.pop()
+            if ancestors:
+                ancestors.pop()
+
+
+def record_fields(record):
+    # The texts the extractors read from a metadata record, with findtext
+    # semantics: None for a missing child, '' for an empty one. lxml's
+    # findtext parses its path in Python, so its records are read in one
+    # pass over their children instead.
+    if not is_lxml(record):
+        return record.findtext('parent-name'), record.findtext('remote-name'), record.findtext('local-type')
+    fields = {}
+    for child in record:
+        tag = child.tag
+        if tag in RECORD_FIELDS and tag not in fields:
+            fields[tag] = child.text or ''
+    return fields.get('parent-name'), fields.get('remote-name'), fields.get('local-type')
+
+
+def _container_records(container):
+    # Reads each field of every record in a container with one XPath call.
+    # The lists line up only when every record has all three fields with
+    # text; otherwise the container falls back to record_fields.
+    count = int(XPATH['record_count'](container))
+    columns = [XPATH[name](container) for name in ('record_parent_names', 'record_remote_names', 'record_local_types')]
+    if all(len(values) == count for values in columns):
+        return list(zip(*columns))
+    return [record_fields(record) for record in XPATH['container_records'](container)]
+
+
+def index_datasource(datasource):
+    if is_lxml(datasource):
+        return _index_datasource_xpath(datasource)
+    entry = {
+        'element': datasource,
+        'connections': [],
+        'tables': [],
+        'records': [],
+        'columns': [],
+        'calculations': [],
+        'relations': [],
+        'relationships': None
+    }
+    open_relations = []
+
+    # Metadata records are read whole by the extractors, so their children
+    # never need to be visited.
+    for elem, ancestors in iter_elements(datasource, prune=('metadata-record',)):
+        depth = len(ancestors)
+        while open_relations and open_relations[-1][0] >= depth:
+            open_relations.pop()
+        if not depth:
+            continue
+
+        tag = elem.tag
+        parent = ancestors[-1]
+        in_connection = depth > 1 and ancestors[1].tag == 'connection'
+
+        if depth == 1:
+            if tag == 'connection':
+                entry['connections'].append({'element': elem, 'named_connections': []})
+            elif tag == 'column':
+                entry['columns'].append(elem)
+        elif tag == 'named-connection' and parent.tag == 'named-connections' and in_connection:
+            entry['connections'][-1]['named_connections'].append(elem)
+        elif tag == 'metadata-record' and parent.tag == 'metadata-records':
+            entry['records'].append(record_fields(elem))
+        elif tag == 'calculation' and parent.tag == 'column':
+            calculations = entry['calculations']
+            if not calculations or calculations[-1][0] is not parent:
+                calculations.append((parent, elem))
+        elif tag == 'expression' and parent.tag == 'clause':
+            if open_relations and depth >= 2 and open_relations[-1][1]['element'] is ancestors[-2]:
+                open_relations[-1][1]['clause'].append(elem)
+        elif tag == 'relationships' and entry['relationships'] is None:
+            entry['relationships'] = elem
+
+        # Relations nest into join trees: a join's operands are its child
+        # relations, in order. Only the roots are listed in 'relations'.
+        if tag == 'relation':
+            if depth == 3 and in_connection and parent.tag == 'relation':
+                entry['tables'].append(elem)
+            relation = {'element': elem, 'children': [], 'clause': []}
+            if open_relations and open_relations[-1][1]['element'] is parent:
+                open_relations[-1][1]['children'].append(relation)
+            else:
+                entry['relations'].append(relation)
+            open_relations.append((depth, relation))
+
+    return entry
+
+
+def _index_datasource_xpath(datasource):
+    # One tag-filtered traversal in C finds everything below the top level.
+    # Locating each kind with its own './/' XPath would rescan the whole
+    # datasource, metadata records included, once per kind.
+    entry = {
+        'element': datasource,
+        'connections': [],
+        'tables': XPATH['tables'](datasource),
+        'records': [],
+        'columns': XPATH['columns'](datasource),
+        'calculations': [],
+        'relations': [],
+        'relationships': None
+    }
+    connections = {}
+    for connection in XPATH['connections'](datasource):
+        connections[connection] = {'element': connection, 'named_connections': []}
+        entry['connections'].append(connections[connection])
+
+    for elem in datasource.iter('metadata-records', 'calculation', 'relation', 'relationships', 'named-connection'):
+        tag = elem.tag
+        parent = elem.getparent()
+        if tag == 'metadata-records':
+            entry['records'].extend(_container_records(elem))
+        elif tag == 'calculation':
+            calculations = entry['calculations']
+            if parent.tag == 'column' and (not calculations or calculations[-1][0] is not parent):
+                calculations.append((parent, elem))
+        elif tag == 'relation':
+            if parent.tag != 'relation':
+                entry['relations'].append(_relation_xpath(elem))
+        elif tag == 'relationships':
+            if entry['relationships'] is None:
+                entry['relationships'] = elem
+        elif parent.tag == 'named-connections':
+            top = parent
+            while top.getparent() is not datasource and top.getparent() is not None:
+                top = top.getparent()
+            if top in connections:
+                connections[top]['named_connections'].append(elem)
+    return entry
+
+
+def _relation_xpath(relation):
+    return {
+        'element': relation,
+        'children': [_relation_xpath(child) for child in XPATH['child_relations'](relation)],
+        'clause': XPATH['clause'](relation)
+    }
+
+
+def index_worksheet(worksheet):
+    if is_lxml(worksheet):
+        mark = XPATH['mark'](worksheet)
+        return {'element': worksheet, 'mark': mark[0] if mark else None}
+    entry = {'element': worksheet, 'mark': None}
+    for elem, ancestors in iter_elements(worksheet):
+        if (elem.tag == 'mark' and len(ancestors) >= 4 and ancestors[-1].tag == 'pane'
+                and ancestors[-2].tag == 'panes' and ancestors[-3].tag == 'table'):
+            entry['mark'] = elem
+            break
+    return entry
+
+
+def index_dashboard(dashboard):
+    if is_lxml(dashboard):
+        # A zone's run is the first one anywhere inside it, as in the walk
+        # below, where a run fills every enclosing zone that has none yet.
+        zones = []
+        for zone in XPATH['zones'](dashboard):
+            run = XPATH['zone_run'](zone)
+            zones.append({'element': zone, 'run': run[0] if run else None})
+        return {'element': dashboard, 'zones': zones}
+    entry = {'element': dashboard, 'zones': []}
+    open_zones = []
+
+    for elem, ancestors in iter_elements(dashboard):
+        depth = len(ancestors)
+        while open_zones and open_zones[-1][0] >= depth:
+            open_zones.pop()
+        if not depth:
+            continue
+
+        parent = ancestors[-1]
+        if elem.tag == 'zone' and parent.tag == 'zones':
+            zone = {'element': elem, 'run': None}
+            entry['zones'].append(zone)
+            open_zones.append((depth, zone))
+        elif elem.tag == 'run' and parent.tag == 'formatted-text':
+            for _, zone in reversed(open_zones):
+                if zone['run'] is not None:
+                    break
+                zone['run'] = elem
+
+    return entry
+
+
+def index_workbook(root):
+    index = {
+        'title': root.get('original-version', 'No title found'),
+        'datasources': [],
+        'worksheets': [],
+        'dashboards': [],
+        'relationships': None
+    }
+
+    for section in root:
+        if section.tag == 'datasources':
+            for datasource in section:
+                if datasource.tag != 'datasource':
+                    continue
+                entry = index_datasource(datasource)
+                index['datasources'].append(entry)
+                if index['relationships'] is None:
+                    index['relationships'] = entry['relationships']
+        elif section.tag == 'dashboards':
+            for dashboard in section:
+                if dashboard.tag == 'dashboard':
+                    index['dashboards'].append(index_dashboard(dashboard))
+        else:
+            for elem, _ in iter_elements(section, prune=('worksheet', 'windows', 'thumbnails')):
+                if elem.tag == 'worksheet':
+                    index['worksheets'].append(index_worksheet(elem))
+
+    return index
@@ -0,0 +1,54 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+
+# A packaged workbook is a zip holding one root .twb plus data extracts that
+# can run to several GB. Only the central directory and the .twb member are
+# ever read; extract payloads are never decompressed.
+
+CHUNK_SIZE = 1024 * 1024
+
+# Limits on the root .twb member, checked against the zip central directory
+# before anything is decompressed.
+MAX_TWB_BYTES = int(os.getenv('TWBX_MAX_TWB_BYTES', 1024 * 1024 * 1024))
+MAX_COMPRESSION_RATIO = float(os.getenv('TWBX_MAX_COMPRESSION_RATIO', 100))
+
+
+class UnsafeArchive(Exception):
+    pass
+
+
+def spool_upload(stream):
+    # ZipFile needs a seekable file. Uploads that Werkzeug already spooled to
+    # disk are used in place; in-memory ones are copied to a temporary file
+    # so the archive is never held in RAM.
+    try:
+        stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        spooled = tempfile.TemporaryFile()
+        shutil.copyfileobj(stream, spooled, CHUNK_SIZE)
+        spooled.seek(0)
+        return spooled
+    stream.seek(0)
+    return contextlib.nullcontext(stream)
+
+
+def find_root_twb(archive):
+    # The workbook sits at the top of the archive; fall back to the first
+    # .twb anywhere for archives packaged by other tools.
+    candidates = [info for info in archive.infolist() if info.filename.lower().endswith('.twb')]
+    for info in candidates:
+        if '/' not in info.filename.strip('/'):
+            return info
+    return candidates[0] if candidates else None
+
+
+def check_member(info, max_bytes=MAX_TWB_BYTES, max_ratio=MAX_COMPRESSION_RATIO):
+    # ZipExtFile never returns more than the declared file_size, so checking
+    # the declared sizes bounds how much a member can decompress to.
+    if info.file_size > max_bytes:
+        raise UnsafeArchive(f"{info.filename} is larger than {max_bytes} bytes")
+    if info.file_size / max(info.compress_size, 1) > max_ratio:
+        raise UnsafeArchive(f"{info.filename} exceeds the allowed compression ratio")
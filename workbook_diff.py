@@ -0,0 +1,76 @@
+import hashlib
+import json
+
+# Content hashes and diffs of extracted workbook metadata. Hashes are taken
+# over the extracted JSON rather than the raw XML, so cosmetic changes to a
+# workbook (window layout, thumbnails, style) do not register as changes.
+
+
+def section_hash(value):
+    text = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def keyed(items, name):
+    # Maps each item to a key derived from its name. Names repeated within a
+    # workbook (e.g. a calculation with the same caption in two datasources)
+    # get a numeric suffix so every item keeps its own key.
+    result = {}
+    for item in items:
+        base = item.get(name) or ''
+        key = base
+        count = 1
+        while key in result:
+            count += 1
+            key = f"{base} ({count})"
+        result[key] = item
+    return result
+
+
+def calculation_hashes(calculations):
+    # Taken over the inlined formula, so a calculation whose dependency
+    # changed counts as changed too.
+    return {key: section_hash(calc) for key, calc in keyed(calculations, 'name').items()}
+
+
+def diff_keyed(old, new):
+    added = [key for key in new if key not in old]
+    removed = [key for key in old if key not in new]
+    changed = [key for key in new if key in old and old[key] != new[key]]
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+
+def diff_unkeyed(old_items, new_items):
+    # For sections whose items have no name (joins), report whole items.
+    old = {section_hash(item): item for item in old_items}
+    new = {section_hash(item): item for item in new_items}
+    return {
+        'added': [item for key, item in new.items() if key not in old],
+        'removed': [item for key, item in old.items() if key not in new],
+        'changed': [],
+    }
+
+
+def diff_metadata(old, new):
+    old_hashes = old.get('hashes', {})
+    new_hashes = new['hashes']
+    diff = {
+        'datasources': diff_keyed(old_hashes.get('datasources', {}), new_hashes['datasources']),
+        'columns': diff_keyed(keyed(old['columns'], 'name'), keyed(new['columns'], 'name')),
+        'calculations': diff_keyed(
+            old_hashes.get('calculations') or calculation_hashes(old['calculations']),
+            new_hashes['calculations']
+        ),
+        'joins': diff_unkeyed(old['joins'], new['joins']),
+        'dashboards': diff_keyed(keyed(old['dashboards'], 'Dashboard Name'), keyed(new['dashboards'], 'Dashboard Name')),
+    }
+    diff['unchanged'] = not any(
+        section[kind] for section in diff.values() for kind in ('added', 'removed', 'changed')
+    )
+    return diff
+
+
+def changed_calculations(new, diff):
+    # The calculations of the new extraction that need converting again.
+    wanted = set(diff['calculations']['added']) | set(diff['calculations']['changed'])
+    return [calc for key, calc in keyed(new['calculations'], 'name').items() if key in wanted]
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# The XML parser behind extraction. lxml is used when it is installed and
+# the stdlib ElementTree otherwise; XML_BACKEND=stdlib forces the fallback.
+# Both backends must produce identical metadata; test_xml_backend.py checks
+# that on synthetic workbooks, and this module does on real ones:
+#   python xml_backend.py workbook.twb [workbook.twb ...]
+
+BACKEND = 'lxml' if lxml_etree is not None and os.getenv('XML_BACKEND', 'lxml') == 'lxml' else 'stdlib'
+
+# Streaming defaults to the stdlib: lxml's iterparse builds a Python proxy
+# for every element it reports, which made it slower on large workbooks.
+STREAM_BACKEND = 'lxml' if lxml_etree is not None and os.getenv('XML_STREAM_BACKEND', 'stdlib') == 'lxml' else 'stdlib'
+
+# Raised by either backend on malformed XML.
+PARSE_ERRORS = (ET.ParseError,) if lxml_etree is None else (ET.ParseError, lxml_etree.XMLSyntaxError)
+
+# Comments and processing instructions are dropped to match ElementTree;
+# entity resolution and network access are disabled for uploaded files.
+LXML_OPTIONS = {
+    'remove_comments': True,
+    'remove_pis': True,
+    'resolve_entities': False,
+    'no_network': True,
+    'huge_tree': True,
+}
+
+if lxml_etree is not None:
+    # Compiled once; used by twb_index for the lookups that dominate
+    # indexing a large datasource.
+    XPATH = {
+        'connections': lxml_etree.XPath('connection'),
+        'tables': lxml_etree.XPath('connection/relation/relation'),
+        'columns': lxml_etree.XPath('column'),
+        'record_count': lxml_etree.XPath('count(metadata-record)'),
+        'container_records': lxml_etree.XPath('metadata-record'),
+        'record_parent_names': lxml_etree.XPath('metadata-record/parent-name[1]/text()[1]', smart_strings=False),
+        'record_remote_names': lxml_etree.XPath('metadata-record/remote-name[1]/text()[1]', smart_strings=False),
+        'record_local_types': lxml_etree.XPath('metadata-record/local-type[1]/text()[1]', smart_strings=False),
+        'child_relations': lxml_etree.XPath('relation'),
+        'clause': lxml_etree.XPath('clause/expression'),
+        'zones': lxml_etree.XPath('.//zones/zone'),
+        'zone_run': lxml_etree.XPath('(.//formatted-text/run)[1]'),
+        'mark': lxml_etree.XPath('(.//table/panes/pane/mark)[1]'),
+    }
+else:
+    XPATH = None
+
+
+def is_lxml(elem):
+    return lxml_etree is not None and isinstance(elem, lxml_etree._Element)
+
+
+def parse(file, backend=None):
+    # Returns the root element of the document.
+    if (backend or BACKEND) == 'lxml':
+        return lxml_etree.parse(file, lxml_etree.XMLParser(**LXML_OPTIONS)).getroot()
+    return ET.parse(file).getroot()
+
+
+def iterparse(file, events, backend=None):
+    if (backend or STREAM_BACKEND) == 'lxml':
+        return lxml_etree.iterparse(file, events=events, **LXML_OPTIONS)
+    return ET.iterparse(file, events=events)
+
+
+if __name__ == '__main__':
+    import json
+
+    from twb_extract import extract_twb_metadata, stream_twb_metadata
+
+    if lxml_etree is None:
+        sys.exit('lxml is not installed; there is only one backend to compare.')
+
+    failed = False
+    for path in sys.argv[1:]:
+        results = {}
+        for backend in ('stdlib', 'lxml'):
+            for mode, extract in (('tree', extract_twb_metadata), ('stream', stream_twb_metadata)):
+                start = time.perf_counter()
+                metadata = extract(path, backend=backend)
+                results[backend, mode] = (json.dumps(metadata, sort_keys=True), time.perf_counter() - start)
+        expected = results['stdlib', 'tree'][0]
+        for (backend, mode), (output, seconds) in results.items():
+            same = output == expected
+            failed = failed or not same
+            print(f"{path} {backend:6} {mode:6} {seconds:7.3f}s {'ok' if same else 'MISMATCH'}")
+    sys.exit(1 if failed else 0)